@@ -1,6 +1,110 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.core.files.storage import default_storage
+from django.http import HttpResponseRedirect
+from django.urls import reverse
+from django.utils.translation import gettext_lazy as _
+from import_export.admin import ImportExportModelAdmin
+from import_export.formats.base_formats import CSV
+
+from core.models import User, Group
+from core.resources import UserResource, GroupResource, start_job
 
 admin.site.site_title = settings.ADMIN_SITE_TITLE
 admin.site.site_header = settings.ADMIN_SITE_HEADER
 admin.site.index_title = settings.ADMIN_INDEX_TITLE
+
+
+class BackgroundExportMixin:
+    """Admin action exporting the selected rows through IMPORT_EXPORT_QUEUE"""
+
+    export_job_resource = None
+
+    @admin.action(description=_("Export selected in the background"))
+    def export_in_background(self, request, queryset):
+        pks = list(queryset.values_list("pk", flat=True))
+        job_id = start_job("export", self.export_job_resource, pks=pks)
+        # progress: python manage.py import_export status <job id>
+        self.message_user(
+            request,
+            _("Export job %(job)s queued") % {"job": job_id},
+            messages.SUCCESS,
+        )
+
+
+class BackgroundImportMixin:
+    """Import uploads larger than IMPORT_BACKGROUND_SIZE through
+    IMPORT_EXPORT_QUEUE instead of within the request, which would outlive
+    the uwsgi harakiri timeout, smaller ones keep the dry-run preview
+    """
+
+    import_job_resource = None
+
+    def import_action(self, request, *args, **kwargs):
+        import_file = request.FILES.get("import_file")
+        if (
+            request.method != "POST"
+            or import_file is None
+            or import_file.size <= settings.IMPORT_BACKGROUND_SIZE
+        ):
+            return super().import_action(request, *args, **kwargs)
+        if not self.has_import_permission(request):
+            raise PermissionDenied
+
+        import_formats = self.get_import_formats()
+        form_type = self.get_import_form()
+        form = form_type(
+            import_formats,
+            request.POST,
+            request.FILES,
+            **self.get_form_kwargs(form_type, *args, **kwargs),
+        )
+        if not form.is_valid():
+            return super().import_action(request, *args, **kwargs)
+        if not issubclass(import_formats[int(form.cleaned_data["input_format"])], CSV):
+            self.message_user(
+                request,
+                _(
+                    "Files over %(size)s bytes are imported in the background, as csv only"
+                )
+                % {"size": settings.IMPORT_BACKGROUND_SIZE},
+                messages.ERROR,
+            )
+            return HttpResponseRedirect(request.get_full_path())
+
+        path = default_storage.save(f"import_export/{import_file.name}", import_file)
+        job_id = start_job("import", self.import_job_resource, path=path)
+        # progress: python manage.py import_export status <job id>
+        self.message_user(
+            request,
+            _("Import job %(job)s queued") % {"job": job_id},
+            messages.SUCCESS,
+        )
+        return HttpResponseRedirect(
+            reverse(
+                "admin:%s_%s_changelist" % self.get_model_info(),
+                current_app=self.admin_site.name,
+            )
+        )
+
+
+@admin.register(User)
+class UserAdmin(BackgroundImportMixin, BackgroundExportMixin, ImportExportModelAdmin):
+    resource_class = UserResource
+    import_job_resource = "user"
+    export_job_resource = "user"
+    actions = ["export_in_background"]
+    list_display = ("id", "username", "name", "phone", "email", "is_active")
+    search_fields = ("username", "name", "phone", "email")
+    list_filter = ("is_active", "sex")
+
+
+@admin.register(Group)
+class GroupAdmin(BackgroundImportMixin, BackgroundExportMixin, ImportExportModelAdmin):
+    resource_class = GroupResource
+    import_job_resource = "group"
+    export_job_resource = "group"
+    actions = ["export_in_background"]
+    list_display = ("id", "name")
+    search_fields = ("name",)
@@ -0,0 +1,58 @@
+import time
+from datetime import datetime, timezone
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+
+from utils.cache_version import bump_versions, version_key
+from utils.redis_func import get_async_pool, get_pool
+
+PENDING = "last_login"
+FLUSHING = "last_login:flushing"
+
+
+def _client():
+    return redis.StrictRedis(connection_pool=get_pool(db=1))
+
+
+def record_last_login(user_id, timestamp=None):
+    """Record a login in redis, written to the users table by flush_last_login()"""
+    _client().hset(PENDING, user_id, timestamp or time.time())
+
+
+async def arecord_last_login(user_id, timestamp=None):
+    """record_last_login() for coroutines"""
+    client = aioredis.StrictRedis(connection_pool=get_async_pool(db=1))
+    await client.hset(PENDING, user_id, timestamp or time.time())
+
+
+def flush_last_login(batch_size=1000):
+    """Write recorded logins with one bulk UPDATE per batch
+
+    The pending hash is renamed first, logins recorded meanwhile go to a
+    new hash. A batch left over by a crashed flush is written again.
+
+    Returns:
+        int: number of users updated
+    """
+    from core.models import User
+
+    client = _client()
+    if not client.exists(FLUSHING):
+        try:
+            if not client.renamenx(PENDING, FLUSHING):
+                return 0
+        except redis.ResponseError:  # nothing recorded
+            return 0
+
+    tz = timezone.utc if settings.USE_TZ else None
+    users = []
+    for user_id, timestamp in client.hgetall(FLUSHING).items():
+        last_login = datetime.fromtimestamp(float(timestamp), tz)
+        users.append(User(pk=int(user_id), last_login=last_login))
+    User.objects.bulk_update(users, ["last_login"], batch_size=batch_size)
+    # bulk_update sends no signals, invalidate the cached responses here
+    bump_versions(version_key(User), *(version_key(User, user.pk) for user in users))
+    client.delete(FLUSHING)
+    return len(users)
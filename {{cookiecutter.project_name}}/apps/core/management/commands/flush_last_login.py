@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.last_login import flush_last_login
+
+
+class Command(BaseCommand):
+    help = "Write the last-login times recorded in redis to the users table"
+
+    def handle(self, *args, **options):
+        count = flush_last_login()
+        self.stdout.write(f"{count} last-login times flushed")
@@ -0,0 +1,39 @@
+import json
+import os
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from core.resources import RESOURCES, get_job, start_job
+
+
+class Command(BaseCommand):
+    help = "Run csv imports/exports in the background through the redis queue"
+
+    def add_arguments(self, parser):
+        sub = parser.add_subparsers(dest="kind", required=True)
+        importer = sub.add_parser("import", help="queue the import of a csv file")
+        importer.add_argument("resource", choices=RESOURCES)
+        importer.add_argument("path", help="local csv file")
+        exporter = sub.add_parser("export", help="queue an export to csv")
+        exporter.add_argument("resource", choices=RESOURCES)
+        status = sub.add_parser("status", help="show the progress of a job")
+        status.add_argument("job_id")
+
+    def handle(self, *args, **options):
+        kind = options["kind"]
+        if kind == "status":
+            job = get_job(options["job_id"])
+            if job is None:
+                raise CommandError(f"Job {options['job_id']} not found")
+            self.stdout.write(json.dumps(job, indent=2, default=str))
+            return
+
+        path = None
+        if kind == "import":
+            with open(options["path"], "rb") as f:
+                name = f"import_export/{os.path.basename(options['path'])}"
+                path = default_storage.save(name, File(f))
+        job_id = start_job(kind, options["resource"], path=path)
+        self.stdout.write(f"Job {job_id} queued")
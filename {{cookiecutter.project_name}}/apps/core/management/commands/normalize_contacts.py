@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+
+from custom.authentication import invalidate_users
+from utils.cache_version import bump_versions, version_key
+
+from core.models import User
+
+FIELDS = ("phone", "email")
+
+
+class Command(BaseCommand):
+    help = (
+        "Store blank phones/emails as NULL and report duplicates, "
+        "run it before the migration that makes them unique"
+    )
+
+    def handle(self, *args, **options):
+        if User._meta.db_table not in connection.introspection.table_names():
+            self.stdout.write("No users table yet, nothing to do")
+            return
+
+        changed = set()
+        with transaction.atomic():
+            for field in FIELDS:
+                blank = User.objects.filter(**{field: ""})
+                ids = list(blank.values_list("pk", flat=True))
+                blank.update(**{field: None})
+                changed.update(ids)
+                self.stdout.write(f"{len(ids)} blank {field} set to NULL")
+        if changed:
+            # update() sends no signals, see core.signals
+            bump_versions(version_key(User), *(version_key(User, pk) for pk in changed))
+            invalidate_users(changed)
+
+        duplicates = 0
+        for field in FIELDS:
+            rows = (
+                User.objects.exclude(**{f"{field}__isnull": True})
+                .values(field)
+                .annotate(count=Count("pk"))
+                .filter(count__gt=1)
+                .order_by(field)
+            )
+            for row in rows.iterator():
+                ids = User.objects.filter(**{field: row[field]}).values_list(
+                    "pk", flat=True
+                )
+                self.stdout.write(f"Duplicate {field} {row[field]}: users {list(ids)}")
+                duplicates += 1
+        if duplicates:
+            raise CommandError(
+                f"{duplicates} duplicate values, resolve them before running migrate"
+            )
+        self.stdout.write("No duplicates, the unique indexes can be created")
@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+
+from utils.redis_func import Queue
+
+logger = logging.getLogger(__name__)
+
+PROMOTE_BATCH = 500
+
+
+def redacted(job):
+    """Copy of a job without the fields it lists in "redact", for logs and the dead list"""
+    return {**job, **{field: "***" for field in job.get("redact", ()) if field in job}}
+
+
+def consumer_id():
+    """Id of this worker run, a restarted container gets the same host and pid,
+    the random part keeps the heartbeat of a crashed run from covering the new one
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+
+
+def requeue_crashed(queue, consumer):
+    """Requeue the jobs of earlier runs with the host and pid of consumer,
+    such a run crashed (a clean stop requeues its own jobs) and its
+    heartbeat may still look alive
+
+    Returns:
+        int: number of requeued jobs
+    """
+    prefix = consumer.rsplit(":", 1)[0] + ":"
+    return sum(
+        queue.reap(name)
+        for name in queue.consumers()
+        if name.startswith(prefix) and name != consumer
+    )
+
+
+class Command(BaseCommand):
+    help = "Drain a redis queue with a pool of worker threads"
+
+    def add_arguments(self, parser):
+        parser.add_argument("queue", help="queue name, see QUEUE_HANDLERS")
+        parser.add_argument("-c", "--concurrency", type=int, default=4)
+        parser.add_argument(
+            "--max-retries", type=int, default=settings.QUEUE_MAX_RETRIES
+        )
+        parser.add_argument(
+            "--backoff", type=float, default=settings.QUEUE_RETRY_BACKOFF
+        )
+        parser.add_argument(
+            "--visibility-timeout",
+            type=int,
+            default=settings.QUEUE_VISIBILITY_TIMEOUT,
+            help="seconds before the jobs of a dead worker are requeued",
+        )
+        parser.add_argument(
+            "--promote-interval",
+            type=float,
+            default=settings.QUEUE_PROMOTE_INTERVAL,
+            help="seconds between promotions of due delayed jobs",
+        )
+
+    def handle(self, *args, **options):
+        name = options["queue"]
+        concurrency = options["concurrency"]
+        visibility_timeout = options["visibility_timeout"]
+        promote_interval = options["promote_interval"]
+        self.max_retries = options["max_retries"]
+        self.backoff = options["backoff"]
+        self.handler = import_string(settings.QUEUE_HANDLERS[name])
+        self.queue = Queue(name)
+        self.dead = Queue(f"{name}:dead")
+        self.consumer = consumer_id()
+        self.stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: self.stop.set())
+        signal.signal(signal.SIGINT, lambda *_: self.stop.set())
+
+        self.periodic = {
+            path: (import_string(path), interval)
+            for path, interval in settings.QUEUE_PERIODIC_TASKS.items()
+        }
+        self.last_runs = dict.fromkeys(self.periodic, 0)
+
+        requeued = requeue_crashed(self.queue, self.consumer)
+        if requeued:
+            logger.warning("Requeued %s jobs of a crashed run", requeued)
+        self.stdout.write(f"Worker of queue {name} started, concurrency {concurrency}")
+        slots = threading.BoundedSemaphore(concurrency)
+        last_beat = last_promote = 0
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while not self.stop.is_set():
+                if time.monotonic() - last_beat > visibility_timeout / 3:
+                    self.queue.heartbeat(self.consumer, visibility_timeout)
+                    self.queue.reap()
+                    last_beat = time.monotonic()
+                if time.monotonic() - last_promote > promote_interval:
+                    while self.queue.promote(PROMOTE_BATCH) == PROMOTE_BATCH:
+                        pass
+                    last_promote = time.monotonic()
+                self.run_periodic()
+                if not slots.acquire(timeout=1):
+                    continue
+                message = self.queue.reserve(self.consumer, timeout=1)
+                if message is None:
+                    slots.release()
+                    continue
+                future = executor.submit(self.process, message)
+                future.add_done_callback(lambda _: slots.release())
+        self.queue.reap(self.consumer)
+        self.stdout.write(f"Worker of queue {name} stopped")
+
+    def run_periodic(self):
+        """Run due QUEUE_PERIODIC_TASKS, once per interval across all workers"""
+        for path, (task, interval) in self.periodic.items():
+            if time.monotonic() - self.last_runs[path] < interval:
+                continue
+            self.last_runs[path] = time.monotonic()
+            if not cache.add(f"periodic:{path}", 1, interval):
+                continue
+            try:
+                task()
+            except Exception:
+                logger.exception("Periodic task %s failed", path)
+            finally:
+                close_old_connections()
+
+    def process(self, message):
+        try:
+            job = json.loads(message)
+        except ValueError:
+            logger.error("Malformed job %r moved to dead-letter list", message)
+            self.dead.append(message)
+            self.queue.ack(self.consumer, message)
+            return
+
+        try:
+            self.handler(job)
+        except Exception:
+            attempts = job.get("attempts", 0) + 1
+            job["attempts"] = attempts
+            if attempts > self.max_retries:
+                logger.exception(
+                    "Job %r failed, moved to dead-letter list", redacted(job)
+                )
+                self.dead.append(json.dumps(redacted(job)))
+                self.queue.ack(self.consumer, message)
+                return
+            logger.warning(
+                "Job %r failed, retry %s", redacted(job), attempts, exc_info=True
+            )
+            self.queue.schedule(
+                json.dumps(job), delay=self.backoff * 2 ** (attempts - 1)
+            )
+            self.queue.ack(self.consumer, message)
+        else:
+            self.queue.ack(self.consumer, message)
+        finally:
+            close_old_connections()
@@ -1,5 +1,5 @@
-from datetime import datetime
 from django.db import models
+from django.utils import timezone
 from django.utils.encoding import smart_str
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth.models import AbstractUser, Group as DjangoGroup
@@ -7,6 +7,8 @@ from model_utils.fields import StatusField
 from model_utils.managers import QueryManager
 from model_utils import Choices
 
+from core.last_login import arecord_last_login, record_last_login
+
 
 class Group(DjangoGroup):
     query = QueryManager()
@@ -28,8 +30,13 @@ class User(AbstractUser):
     description = models.CharField(
         _("Description"), max_length=32, null=True, blank=True
     )
-    phone = models.CharField(_("PhoneNumber"), max_length=24, null=True, blank=True)
-    email = models.CharField(_("Email"), max_length=64, null=True, blank=True)
+    # unique indexes, blank values are stored as NULL so they never collide
+    phone = models.CharField(
+        _("PhoneNumber"), max_length=24, unique=True, null=True, blank=True
+    )
+    email = models.CharField(
+        _("Email"), max_length=64, unique=True, null=True, blank=True
+    )
     is_superuser = models.BooleanField(_("IsSuperUser"), default=False)
 
     query = QueryManager()
@@ -44,6 +51,30 @@ class User(AbstractUser):
     def __str__(self):
         return smart_str("%s-%s" % (self.username, self.name))
 
-    def update_last_login(self):
-        self.last_login = datetime.now()
-        self.save()
+    def save(self, *args, **kwargs):
+        self.normalize_unique_fields()
+        super().save(*args, **kwargs)
+
+    def normalize_unique_fields(self):
+        """Store blank phone/email as NULL, so they never collide in the unique
+        indexes, bulk_create/bulk_update callers must call it themselves
+        """
+        self.phone = self.phone or None
+        self.email = self.email or None
+
+    def update_last_login(self, sync=False):
+        """Record a login, written in batches by core.last_login.flush_last_login
+
+        Args:
+            sync (bool): update the last_login column right away instead
+        """
+        self.last_login = timezone.now()
+        if sync:
+            self.save(update_fields=["last_login"])
+        else:
+            record_last_login(self.pk, self.last_login.timestamp())
+
+    async def aupdate_last_login(self):
+        """update_last_login() for coroutines"""
+        self.last_login = timezone.now()
+        await arecord_last_login(self.pk, self.last_login.timestamp())
@@ -0,0 +1,230 @@
+import csv
+import io
+import json
+import logging
+import os
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import tablib
+from django.conf import settings
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from import_export import resources
+from import_export.instance_loaders import CachedInstanceLoader
+
+from custom.authentication import invalidate_users
+from utils.cache_version import bump_versions, version_key
+from utils.redis_func import Queue
+
+from core.models import User, Group
+
+logger = logging.getLogger(__name__)
+
+
+def _needs_hashing(password):
+    if not password:
+        return False
+    try:
+        identify_hasher(password)
+        return False  # already hashed, e.g. exported from another site
+    except ValueError:
+        return True
+
+
+class BulkModelResource(resources.ModelResource):
+    """ModelResource that writes rows with bulk_create/bulk_update,
+    one transaction per batch, and loads existing rows in one query
+    """
+
+    def bulk_create(self, using_transactions, dry_run, raise_errors, batch_size=None):
+        with transaction.atomic():
+            super().bulk_create(using_transactions, dry_run, raise_errors, batch_size)
+
+    def bulk_update(self, using_transactions, dry_run, raise_errors, batch_size=None):
+        with transaction.atomic():
+            super().bulk_update(using_transactions, dry_run, raise_errors, batch_size)
+
+    class Meta:
+        use_bulk = True
+        batch_size = 1000
+        use_transactions = False
+        skip_diff = True
+        chunk_size = 2000
+        instance_loader_class = CachedInstanceLoader
+
+
+class UserResource(BulkModelResource):
+    """Users, plain-text passwords are hashed before the row loop,
+    in parallel since PBKDF2 releases the GIL
+    """
+
+    def before_import(self, dataset, using_transactions, dry_run, **kwargs):
+        if "password" not in dataset.headers or dry_run:
+            return
+        passwords = list(dataset["password"])
+        plain = [i for i, password in enumerate(passwords) if _needs_hashing(password)]
+        workers = min(32, (os.cpu_count() or 1) * 2)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            hashed = executor.map(make_password, [passwords[i] for i in plain])
+            for i, password in zip(plain, hashed):
+                passwords[i] = password
+        del dataset["password"]
+        dataset.append_col(passwords, header="password")
+
+    def import_field(self, field, obj, data, is_m2m=False, **kwargs):
+        # a blank password keeps the current one, new users get an unusable one
+        if field.attribute == "password" and not data.get(field.column_name):
+            if obj.pk is None:
+                obj.set_unusable_password()
+            return
+        super().import_field(field, obj, data, is_m2m, **kwargs)
+
+    def before_save_instance(self, instance, using_transactions, dry_run):
+        # bulk_create skips User.save()
+        instance.normalize_unique_fields()
+
+    def bulk_update(self, using_transactions, dry_run, raise_errors, batch_size=None):
+        user_ids = [user.pk for user in self.update_instances]
+        super().bulk_update(using_transactions, dry_run, raise_errors, batch_size)
+        if user_ids and not dry_run:
+            # bulk_update sends no signals, see core.signals
+            bump_versions(*(version_key(User, pk) for pk in user_ids))
+            invalidate_users(user_ids)
+
+    def after_import(self, dataset, result, using_transactions, dry_run, **kwargs):
+        if not dry_run:
+            bump_versions(version_key(User))
+
+    def get_export_fields(self):
+        return [
+            field
+            for field in super().get_export_fields()
+            if field.column_name != "password"
+        ]
+
+    class Meta(BulkModelResource.Meta):
+        model = User
+        fields = (
+            "id",
+            "username",
+            "password",
+            "name",
+            "sex",
+            "description",
+            "phone",
+            "email",
+            "is_active",
+            "date_joined",
+        )
+
+
+class GroupResource(resources.ModelResource):
+    # Group inherits auth.Group through a table, which bulk_create cannot
+    # insert, groups are few and go through the regular row path
+    class Meta:
+        model = Group
+        fields = ("id", "name")
+        skip_diff = True
+        instance_loader_class = CachedInstanceLoader
+
+
+RESOURCES = {"user": UserResource, "group": GroupResource}
+JOB_TIMEOUT = 86400
+IMPORT_CHUNK_SIZE = 10000
+
+
+def get_job(job_id):
+    """Return the progress of a background import/export job, or None"""
+    return cache.get(f"import_export:{job_id}")
+
+
+def _save_job(job_id, **state):
+    job = get_job(job_id) or {}
+    job.update(state)
+    cache.set(f"import_export:{job_id}", job, JOB_TIMEOUT)
+    return job
+
+
+def start_job(kind, resource, path=None, pks=None):
+    """Queue a background import or export of a resource
+
+    Args:
+        kind (str): import or export
+        resource (str): key of RESOURCES
+        path (str): csv file in default_storage to import
+        pks (list): primary keys to export, all rows if None
+
+    Returns:
+        str: job id, progress is read by get_job()
+    """
+    job_id = uuid.uuid4().hex
+    _save_job(job_id, kind=kind, resource=resource, status="queued", processed=0)
+    job = {"id": job_id, "kind": kind, "resource": resource, "path": path, "pks": pks}
+    Queue(settings.IMPORT_EXPORT_QUEUE).append(json.dumps(job))
+    return job_id
+
+
+def run_job(job):
+    """Queue handler of IMPORT_EXPORT_QUEUE, failed jobs are not retried
+    since an import may have written part of its rows
+
+    Args:
+        job (dict): job pushed by start_job
+    """
+    resource = RESOURCES[job["resource"]]()
+    _save_job(job["id"], status="running")
+    try:
+        if job["kind"] == "import":
+            state = _run_import(job["id"], resource, job["path"])
+        else:
+            state = _run_export(job["id"], resource, job["pks"])
+    except Exception as e:
+        logger.exception("Import/export job %s failed", job["id"])
+        _save_job(job["id"], status="failed", error=str(e))
+        return
+    _save_job(job["id"], status="done", **state)
+
+
+def _run_import(job_id, resource, path):
+    totals = {}
+    processed = 0
+    with default_storage.open(path, "rb") as f:
+        reader = csv.reader(io.TextIOWrapper(f, encoding="utf-8-sig"))
+        headers = next(reader)
+        while True:
+            rows = [row for _, row in zip(range(IMPORT_CHUNK_SIZE), reader)]
+            if not rows:
+                break
+            result = resource.import_data(tablib.Dataset(*rows, headers=headers))
+            for key, value in result.totals.items():
+                totals[key] = totals.get(key, 0) + value
+            processed += len(rows)
+            _save_job(job_id, processed=processed, totals=totals)
+    return {"processed": processed, "totals": totals}
+
+
+def _run_export(job_id, resource, pks):
+    queryset = resource.get_queryset()
+    if pks is not None:
+        queryset = queryset.filter(pk__in=pks)
+    processed = 0
+    with tempfile.TemporaryFile() as f:
+        text = io.TextIOWrapper(f, encoding="utf-8", newline="")
+        writer = csv.writer(text)
+        writer.writerow(resource.get_export_headers())
+        for obj in resource.iter_queryset(queryset):
+            writer.writerow(resource.export_resource(obj))
+            processed += 1
+            if processed % resource.get_chunk_size() == 0:
+                _save_job(job_id, processed=processed)
+        text.flush()
+        text.detach()
+        f.seek(0)
+        name = f"import_export/{resource._meta.model._meta.model_name}-{job_id}.csv"
+        name = default_storage.save(name, File(f))
+    return {"processed": processed, "file": name, "url": default_storage.url(name)}
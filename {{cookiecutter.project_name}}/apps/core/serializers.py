@@ -1,6 +1,10 @@
-import re
+from django.db.models.signals import post_save
+from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 
+from custom.serializers import ValuesSerializerMixin
+from utils.verify import PHONE_PATTERN
+
 from core.models import User, Group
 
 
@@ -9,7 +13,7 @@ class GroupSerializer(serializers.ModelSerializer):
         model = Group
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(ValuesSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         exclude = ["is_staff", "is_active", "user_permissions"]
@@ -23,15 +27,47 @@ class UserSerializer(serializers.ModelSerializer):
         extra_kwargs = {"password": {"write_only": True}}
 
 
+class UserBatchUpdateSerializer(serializers.ModelSerializer):
+    """Fields a user may change with PATCH /users/batch/, the password and
+    groups are left to dedicated endpoints
+    """
+
+    class Meta:
+        model = User
+        fields = ["name", "sex", "description", "phone", "email"]
+
+
 class LoginOrRegisterSerializer(serializers.Serializer):
     phone = serializers.CharField(max_length=11)
     verification_code = serializers.CharField(max_length=6)
 
     def create(self, validated_data):
-        user, created = User.objects.get_or_create(
-            phone=validated_data["phone"],
-            defaults={"username": validated_data["phone"]},
-        )
+        phone = validated_data["phone"]
+        user = User.objects.filter(phone=phone).first()
+        if user is not None:
+            return user
+
+        # INSERT ... ON CONFLICT DO NOTHING (INSERT IGNORE on mysql), concurrent
+        # first logins of a phone insert one row and all read the same user
+        candidate = User(phone=phone, username=phone)
+        User.objects.bulk_create([candidate], ignore_conflicts=True)
+        user = User.objects.filter(phone=phone).first()
+        if user is None:
+            # the username is taken by a user with another phone
+            raise serializers.ValidationError(_("The user already exists."))
+        # the ignored insert returns no id, the row is ours if it carries
+        # the date_joined (to the microsecond) of the candidate
+        if user.date_joined == candidate.date_joined:
+            # bulk_create sends no signals, the caches of core.signals need one,
+            # a concurrent request that inserted the row sends its own
+            post_save.send(
+                sender=User,
+                instance=user,
+                created=True,
+                raw=False,
+                using=user._state.db,
+                update_fields=None,
+            )
         return user
 
 
@@ -39,8 +75,7 @@ class PhoneVerificationSerializer(serializers.Serializer):
     phone = serializers.CharField(max_length=11)
 
     def validate_phone(self, phone):
-        pattern = re.compile(r"^1[3-9]\d{9}$")
-        if not pattern.match(phone):
+        if not PHONE_PATTERN.match(phone):
             raise serializers.ValidationError("无效的手机号")
         return phone
 
@@ -0,0 +1,37 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from custom.authentication import invalidate_user as invalidate_cached_user
+from utils.cache_version import bump_versions, version_key
+
+from core.models import User, Group
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance, **kwargs):
+    bump_versions(version_key(User, instance.pk), version_key(User))
+    # after commit, so a concurrent request cannot cache the old row again
+    transaction.on_commit(partial(invalidate_cached_user, instance.pk))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group(sender, instance, **kwargs):
+    # deleting a group also removes its members' rows without m2m_changed,
+    # every response depending on groups goes with the collection counter
+    bump_versions(version_key(Group, instance.pk), version_key(Group))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_user_groups(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if reverse:
+        # group.user_set changes, the affected users are not known on clear
+        bump_versions(version_key(Group))
+    else:
+        bump_versions(version_key(User, instance.pk), version_key(User))
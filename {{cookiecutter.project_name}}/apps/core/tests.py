@@ -0,0 +1,113 @@
+import json
+import uuid
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from rest_framework.test import APIClient
+
+from custom.pagination import KeysetPagination
+from utils.redis_func import Queue
+
+from core.management.commands.worker import consumer_id, requeue_crashed
+from core.models import Group, User
+from core.views import UserViewSet
+
+
+@mock.patch.object(UserViewSet, "cache_timeout", 0)
+@mock.patch.object(KeysetPagination, "count_mode", "none")
+class UserListQueriesTests(TestCase):
+    """Listing users costs the same number of queries for any number of rows"""
+
+    @classmethod
+    def setUpTestData(cls):
+        groups = [Group.objects.create(name=f"group{i}") for i in range(3)]
+        for i in range(12):
+            user = User.objects.create(username=f"user{i}", phone=f"1380000{i:04}")
+            user.groups.set(groups[: i % 3 + 1])
+        cls.user = User.objects.first()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, path, queries):
+        # streamed content is read inside the block, the rows are queried lazily
+        with self.assertNumQueries(queries):
+            response = self.client.get(path)
+            content = b"".join(response) if response.streaming else response.content
+        self.assertEqual(response.status_code, 200)
+        return content
+
+    def test_list(self):
+        for page_size in (2, 10):
+            content = self.get(f"/users/?page_size={page_size}", 2)
+            results = json.loads(content)["data"]["results"]
+            self.assertEqual(len(results), page_size)
+            self.assertTrue(all(user["groups"] for user in results))
+
+    def test_stream(self):
+        content = self.get("/users/?stream=true", 2)
+        self.assertEqual(len(json.loads(content)["data"]), 12)
+
+    def test_export(self):
+        content = self.get("/users/export/", 2)
+        self.assertEqual(len(content.splitlines()), 12)
+
+    def test_export_csv(self):
+        content = self.get("/users/export/?output=csv", 2)
+        self.assertEqual(len(content.splitlines()), 13)
+
+
+class UserRetrieveCacheTests(TestCase):
+    """A cached user is invalidated whatever spelling of its pk the url used"""
+
+    def setUp(self):
+        self.viewer = User.objects.create(username="viewer", phone="13800000001")
+        self.user = User.objects.create(username="user", name="old")
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def test_padded_pk(self):
+        path = f"/users/0{self.user.pk}/"
+        self.assertEqual(self.client.get(path).json()["data"]["name"], "old")
+        self.user.name = "new"
+        self.user.save()
+        self.assertEqual(self.client.get(path).json()["data"]["name"], "new")
+
+    def test_invalid_pk(self):
+        self.assertEqual(self.client.get("/users/x/").status_code, 404)
+
+
+@mock.patch("core.management.commands.worker.os.getpid", return_value=1)
+@mock.patch("core.management.commands.worker.socket.gethostname", return_value="worker")
+class WorkerRestartTests(SimpleTestCase):
+    """A worker restarted in the same container requeues the jobs of its crashed run"""
+
+    def setUp(self):
+        self.queue = Queue(f"test:{uuid.uuid4().hex}")
+        self.addCleanup(self.cleanup)
+
+    def cleanup(self):
+        for consumer in self.queue.consumers():
+            self.queue.reap(consumer)
+        self.queue.clear()
+
+    def test_restart_after_crash(self, gethostname, getpid):
+        crashed = consumer_id()
+        self.queue.append("job")
+        self.queue.heartbeat(crashed, 60)
+        self.assertEqual(self.queue.reserve(crashed, timeout=1), "job")
+        # a worker of another pid, still alive
+        other = f"worker:2:{uuid.uuid4().hex}"
+        self.queue.append("other job")
+        self.queue.heartbeat(other, 60)
+        self.queue.reserve(other, timeout=1)
+
+        restarted = consumer_id()
+        self.assertNotEqual(restarted, crashed)
+        self.queue.heartbeat(restarted, 60)
+        # the heartbeat of the crashed run has not expired yet
+        self.assertEqual(self.queue.reap(), 0)
+        self.assertEqual(requeue_crashed(self.queue, restarted), 1)
+        self.assertEqual(self.queue.get_all(), ["job"])
+        self.assertEqual(self.queue.consumers(), {restarted, other})
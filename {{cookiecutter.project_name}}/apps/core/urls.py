@@ -1,14 +1,27 @@
+from django.conf import settings
 from django.urls import path, include
-from core.views import UserViewSet, LoginOrRegisterView, PhoneVerificationView
+from core.views import (
+    UserViewSet,
+    LoginOrRegisterView,
+    PhoneVerificationView,
+    AsyncLoginOrRegisterView,
+    AsyncPhoneVerificationView,
+)
 from rest_framework_nested import routers
 
 router = routers.DefaultRouter()
 router.register(r"users", UserViewSet, basename="user")
 # router.register(r"verification", VerificationViewSet, basename="verification")
 user_router = routers.NestedDefaultRouter(router, r"users", lookup="user")
+if settings.SERVER == "uvicorn":
+    login_view = AsyncLoginOrRegisterView
+    verification_view = AsyncPhoneVerificationView
+else:
+    login_view = LoginOrRegisterView
+    verification_view = PhoneVerificationView
 urlpatterns = [
-    path(r"login/", LoginOrRegisterView.as_view()),
-    path(r"verification/phone", PhoneVerificationView.as_view()),
+    path(r"login/", login_view.as_view()),
+    path(r"verification/phone", verification_view.as_view()),
     path(r"", include(router.urls)),
     path(r"", include(user_router.urls)),
 ]
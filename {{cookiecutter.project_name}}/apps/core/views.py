@@ -1,4 +1,5 @@
 import random
+from asgiref.sync import sync_to_async
 from django.utils.translation import gettext_lazy as _
 from rest_framework import mixins
 from rest_framework.permissions import AllowAny
@@ -7,25 +8,80 @@ from rest_framework.generics import GenericAPIView
 from rest_framework.viewsets import GenericViewSet
 from rest_framework_simplejwt.tokens import RefreshToken
 from custom.exceptions import CustomAPIError
-from utils.redis_func import Client as RedisClient
-from utils.verify import send_email, send_sms, set_verification_code
-
-from core.models import User
+from custom.mixins import (
+    AutoPrefetchMixin,
+    BatchMixin,
+    CachedResponseMixin,
+    ExportMixin,
+    ReplicaReadMixin,
+    StreamingListModelMixin,
+    ValuesListModelMixin,
+)
+from custom.pagination import KeysetPagination
+from custom.throttling import RedisScopedThrottle
+from custom.views import AsyncAPIView
+from utils.verify import (
+    set_verification_code,
+    aset_verification_code,
+    dispatch_verification_code,
+    adispatch_verification_code,
+    check_verification_code,
+    acheck_verification_code,
+    CODE_OK,
+    CODE_WRONG,
+    CODE_LOCKED,
+)
+
+from core.models import User, Group
 import core.serializers as serializers
 
 
 class UserViewSet(
+    CachedResponseMixin,
     mixins.RetrieveModelMixin,
-    mixins.ListModelMixin,
+    StreamingListModelMixin,
+    ExportMixin,
+    BatchMixin,
+    ValuesListModelMixin,
+    AutoPrefetchMixin,
+    ReplicaReadMixin,
     GenericViewSet,
 ):
     queryset = User.query.all()
     serializer_class = serializers.UserSerializer
+    batch_serializer_class = serializers.UserBatchUpdateSerializer
+    pagination_class = KeysetPagination
+    cache_dependencies = (Group,)
+
+    def perform_batch_update(self, instances, fields):
+        # bulk_update skips User.save()
+        for user in instances:
+            user.normalize_unique_fields()
+        super().perform_batch_update(instances, fields)
+
+
+def check_code_status(status):
+    if status == CODE_LOCKED:
+        raise CustomAPIError(_("Too many failed attempts, please try again later"))
+    elif status == CODE_WRONG:
+        raise CustomAPIError(_("Verification code error"))
+    elif status != CODE_OK:
+        raise CustomAPIError(_("The verification code does not exist or has expired"))
+
+
+def token_pair(user):
+    refresh = RefreshToken.for_user(user)
+    return {
+        "refresh": str(refresh),
+        "access": str(refresh.access_token),
+    }
 
 
 class LoginOrRegisterView(GenericAPIView):
     authentication_classes = []
     permission_classes = [AllowAny]
+    throttle_classes = [RedisScopedThrottle]
+    throttle_scope = "login"
     queryset = User.query.all()
     serializer_class = serializers.LoginOrRegisterSerializer
 
@@ -34,33 +90,44 @@ class LoginOrRegisterView(GenericAPIView):
         serializer.is_valid(raise_exception=True)
 
         # 校验验证码
-        r = RedisClient()
         phone = serializer.validated_data["phone"]
         verification_code = serializer.validated_data["verification_code"]
-        key = f"register_{phone}"
-        if r.get(key):
-            if str(verification_code) == r.get(key):
-                r.delete(key)
-            else:
-                raise CustomAPIError(_("Verification code error"))
-        else:
-            raise CustomAPIError(
-                _("The verification code does not exist or has expired")
-            )
+        check_code_status(
+            check_verification_code("register", phone, str(verification_code))
+        )
 
         user = serializer.save()
-        refresh = RefreshToken.for_user(user)
-        return Response(
-            {
-                "refresh": str(refresh),
-                "access": str(refresh.access_token),
-            }
+        user.update_last_login()
+        return Response(token_pair(user))
+
+
+class AsyncLoginOrRegisterView(AsyncAPIView):
+    """LoginOrRegisterView for ASGI, only the user lookup runs in a thread"""
+
+    throttle_classes = [RedisScopedThrottle]
+    throttle_scope = "login"
+    serializer_class = serializers.LoginOrRegisterSerializer
+
+    async def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        phone = serializer.validated_data["phone"]
+        verification_code = serializer.validated_data["verification_code"]
+        check_code_status(
+            await acheck_verification_code("register", phone, str(verification_code))
         )
 
+        user = await sync_to_async(serializer.save)()
+        await user.aupdate_last_login()
+        return token_pair(user)
+
 
 class PhoneVerificationView(GenericAPIView):
     authentication_classes = []
     permission_classes = [AllowAny]
+    throttle_classes = [RedisScopedThrottle]
+    throttle_scope = "verification"
     queryset = User.query.all()
     serializer_class = serializers.PhoneVerificationSerializer
 
@@ -70,13 +137,29 @@ class PhoneVerificationView(GenericAPIView):
 
         phone = serializer.validated_data["phone"]
         verification_code = str(random.randint(100000, 999999))
-        ret = send_sms(phone, verification_code, "register")
-        if ret["SendStatusSet"][0]["Code"] != "Ok":
-            return CustomAPIError(_("Verification code send failed"))
         set_verification_code("register", phone, verification_code)
+        dispatch_verification_code("sms", "register", phone, verification_code)
         return Response({"msg": _("Verification code send success")})
 
 
+class AsyncPhoneVerificationView(AsyncAPIView):
+    """PhoneVerificationView for ASGI, waits on redis without holding a thread"""
+
+    throttle_classes = [RedisScopedThrottle]
+    throttle_scope = "verification"
+    serializer_class = serializers.PhoneVerificationSerializer
+
+    async def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        phone = serializer.validated_data["phone"]
+        verification_code = str(random.randint(100000, 999999))
+        await aset_verification_code("register", phone, verification_code)
+        await adispatch_verification_code("sms", "register", phone, verification_code)
+        return {"msg": _("Verification code send success")}
+
+
 # class VerificationViewSet(GenericViewSet):
 #     authentication_classes = []
 #     permission_classes = [AllowAny]
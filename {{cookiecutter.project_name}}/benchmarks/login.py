@@ -0,0 +1,92 @@
+"""Latency of the phone login path (LoginOrRegisterSerializer.create)
+against a users table of the given size
+
+Fills the table once (generate_series on postgres, batched inserts
+elsewhere), then times logins of existing users and first logins.
+Run it against a scratch database, e.g. 10M users:
+    python benchmarks/login.py 10000000
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault(
+    "DJANGO_SETTINGS_MODULE", "{{cookiecutter.project_name}}.settings"
+)
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+
+from core.models import User  # noqa: E402
+from core.serializers import LoginOrRegisterSerializer  # noqa: E402
+
+PHONE_BASE = 13000000000
+BATCH = 10000
+
+
+def phone(i):
+    return str(PHONE_BASE + i)
+
+
+def fill(users):
+    existing = User.objects.filter(phone__startswith="1").count()
+    if existing >= users:
+        return
+    print(f"inserting {users - existing} users...")
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {User._meta.db_table}
+                    (password, is_superuser, username, first_name, last_name,
+                     is_staff, is_active, date_joined, name, sex, phone)
+                SELECT '', false, ({PHONE_BASE} + i)::text, '', '',
+                    false, true, now(), '', '0', ({PHONE_BASE} + i)::text
+                FROM generate_series(%s, %s) AS i
+                """,
+                [existing, users - 1],
+            )
+            cursor.execute(f"ANALYZE {User._meta.db_table}")
+        return
+    for start in range(existing, users, BATCH):
+        User.objects.bulk_create(
+            User(username=phone(i), phone=phone(i))
+            for i in range(start, min(start + BATCH, users))
+        )
+
+
+def measure(phones):
+    timings = []
+    for p in phones:
+        start = time.perf_counter()
+        LoginOrRegisterSerializer().create({"phone": p, "verification_code": ""})
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return (
+        statistics.median(timings) * 1000,
+        timings[int(len(timings) * 0.99) - 1] * 1000,
+    )
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+    samples = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    fill(users)
+
+    existing = [phone(random.randrange(users)) for _ in range(samples)]
+    new = [phone(users + i) for i in range(samples)]
+    print(f"{users} users, {samples} logins each")
+    for name, phones in (("existing user", existing), ("first login", new)):
+        p50, p99 = measure(phones)
+        print(f"{name:<14} p50 {p50:>8.3f} ms   p99 {p99:>8.3f} ms")
+    User.objects.filter(phone__in=new).delete()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Render time and allocations of CustomRenderer on a large UserViewSet page
+
+Usage:
+    python benchmarks/renderer.py [rows]
+"""
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault(
+    "DJANGO_SETTINGS_MODULE", "{{cookiecutter.project_name}}.settings"
+)
+
+import django  # noqa: E402
+
+django.setup()
+
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+import custom.renderers  # noqa: E402
+from custom.renderers import CustomRenderer  # noqa: E402
+
+
+class StdlibRenderer(JSONRenderer):
+    """CustomRenderer before the fast backend, copies the page into a new envelope"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        data = dict(data)
+        res = {
+            "code": data.pop("code", 200),
+            "msg": data.pop("msg", "success"),
+            "data": data,
+        }
+        return super().render(res, accepted_media_type, renderer_context)
+
+
+def user_page(rows):
+    now = datetime.now()
+    results = [
+        {
+            "id": i,
+            "uuid": uuid.uuid4(),
+            "password": "",
+            "last_login": now,
+            "is_superuser": False,
+            "username": f"user{i}",
+            "first_name": "",
+            "last_name": "",
+            "email": f"user{i}@example.com",
+            "date_joined": now,
+            "name": f"Name {i}",
+            "avatar": None,
+            "sex": i % 3,
+            "description": "description of user",
+            "phone": f"138{i:08d}",
+            "balance": Decimal("12.50"),
+            "groups": [1, 2],
+        }
+        for i in range(rows)
+    ]
+    return {"next": "http://testserver/users/?cursor=cD0yMA%3D%3D", "results": results}
+
+
+def measure(renderer, data, repeat=5):
+    context = {"view": None, "request": None, "response": None}
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        renderer.render(data, "application/json", context)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    renderer.render(data, "application/json", context)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    data = user_page(rows)
+    orjson = custom.renderers.orjson
+    cases = [("stdlib json, copied envelope", StdlibRenderer())]
+    if orjson is not None:
+        cases.append(("CustomRenderer, orjson", CustomRenderer()))
+    custom.renderers.orjson = None
+    cases.append(("CustomRenderer, stdlib fallback", CustomRenderer()))
+
+    print(f"{rows} rows")
+    for name, renderer in cases:
+        custom.renderers.orjson = orjson if "orjson" in name else None
+        best, peak = measure(renderer, data)
+        print(f"{name:<34} {best * 1000:>9.2f} ms {peak / 1024 / 1024:>9.2f} MiB peak")
+    custom.renderers.orjson = orjson
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+
+def user_cache_key(user_id):
+    return f"auth:user:{user_id}"
+
+
+def revoked_key(jti):
+    return f"auth:revoked:{jti}"
+
+
+def invalidate_user(user_id):
+    """Drop a cached user from redis and from every worker's memory"""
+    caches[settings.AUTH_USER_CACHE].delete(user_cache_key(user_id))
+
+
+def invalidate_users(user_ids):
+    """invalidate_user() of many users with one delete and one publish"""
+    caches[settings.AUTH_USER_CACHE].delete_many(
+        [user_cache_key(user_id) for user_id in user_ids]
+    )
+
+
+def revoke_token(token):
+    """Reject a token until it expires, e.g. on logout or password change"""
+    ttl = int(token["exp"] - time.time())
+    if ttl > 0:
+        caches[settings.AUTH_USER_CACHE].l2.set(
+            revoked_key(token[api_settings.JTI_CLAIM]), 1, ttl
+        )
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that resolves the user from the tiered cache
+
+    The token's revocation key and, when the user is not in memory, the
+    cached user are read from redis in one pipelined round trip. The
+    database is only queried when the user is in neither tier, active
+    users are then cached for AUTH_USER_CACHE_TIMEOUT seconds. Memory
+    holds the column values of a user, a new instance is built for every
+    request.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        cache = caches[settings.AUTH_USER_CACHE]
+        l2 = cache.l2
+        key = user_cache_key(user_id)
+        jti = validated_token.get(api_settings.JTI_CLAIM)
+        generation = cache.generation
+        user = cache.get_local(key)
+
+        pipe = l2.client.get_client(write=False).pipeline(transaction=False)
+        if jti:
+            pipe.exists(l2.make_key(revoked_key(jti)))
+        if user is None:
+            pipe.get(l2.make_key(key))
+        results = pipe.execute()
+
+        if jti and results.pop(0):
+            raise InvalidToken(_("Token is blacklisted"))
+        if user is not None:
+            return self.build_user(user)
+        if results[0] is not None:
+            user = l2.client.decode(results[0])
+        else:
+            user = super().get_user(validated_token)
+            l2.set(key, user, settings.AUTH_USER_CACHE_TIMEOUT)
+        cache.set_local(key, self.user_fields(user), generation)
+        return user
+
+    def user_fields(self, user):
+        """Column values of a user, kept in memory instead of the instance"""
+        return {
+            field.attname: getattr(user, field.attname)
+            for field in user._meta.concrete_fields
+        }
+
+    def build_user(self, fields):
+        # every request gets its own instance, changes do not leak across requests
+        return self.user_model.from_db(None, list(fields), list(fields.values()))
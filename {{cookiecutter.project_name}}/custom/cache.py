@@ -0,0 +1,309 @@
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+_MISSING = object()
+
+
+class LocalTier:
+    """In-process LRU/TTL store (L1) of TieredCache and its invalidation subscriber
+
+    Django creates a cache object per thread, the L1 of a configuration is
+    shared by all of them through get_local_tier(), so a process holds one
+    copy of every entry and runs one subscriber thread.
+    """
+
+    def __init__(self, l2_alias, channel, timeout, max_entries, max_bytes):
+        self.l2_alias = l2_alias
+        self.channel = channel
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.pid = None
+        self.reset()
+
+    def reset(self):
+        self.entries = OrderedDict()  # key -> (value, expires, size)
+        self.bytes = 0
+        self.generation = 0
+        self.subscribed = False
+        self.stats = dict.fromkeys(
+            ("hits", "misses", "evictions", "expirations", "invalidations"), 0
+        )
+        self.l2_stats = dict.fromkeys(("hits", "misses"), 0)
+
+    def ensure_subscriber(self):
+        # threads do not survive a fork, every worker starts its own
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.reset()
+            self.pid = os.getpid()
+            threading.Thread(target=self._subscribe, daemon=True).start()
+
+    def _subscribe(self):
+        pid = self.pid
+        while self.pid == pid:
+            pubsub = None
+            try:
+                client = caches[self.l2_alias].client.get_client(write=False)
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                pubsub.get_message(timeout=5)  # subscribe confirmation
+                self.subscribed = True
+                for message in pubsub.listen():
+                    self._on_message(message["data"])
+            except (redis.RedisError, OSError):
+                pass
+            finally:
+                # invalidations may have been missed while disconnected
+                self.subscribed = False
+                self.clear()
+                if pubsub is not None:
+                    pubsub.close()
+            time.sleep(1)
+
+    def _on_message(self, data):
+        keys = json.loads(data)
+        if keys is None:
+            self.clear()
+            return
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                entry = self.entries.pop(key, None)
+                if entry is not None:
+                    self.bytes -= entry[2]
+                    self.stats["invalidations"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.bytes = 0
+
+    def drop(self, keys):
+        with self.lock:
+            for key in keys:
+                entry = self.entries.pop(key, None)
+                if entry is not None:
+                    self.bytes -= entry[2]
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return _MISSING
+        if entry[1] < time.monotonic():
+            with self.lock:
+                if self.entries.get(key) is entry:
+                    del self.entries[key]
+                    self.bytes -= entry[2]
+                self.stats["expirations"] += 1
+                self.stats["misses"] += 1
+            return _MISSING
+        self.stats["hits"] += 1
+        try:
+            self.entries.move_to_end(key)
+        except KeyError:
+            pass
+        return entry[0]
+
+    def set(self, key, value, generation):
+        try:
+            size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        except (pickle.PickleError, TypeError, AttributeError):
+            return
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            # an invalidation arrived while the value was read from L2
+            if generation != self.generation:
+                return
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self.entries[key] = (value, time.monotonic() + self.timeout, size)
+            self.bytes += size
+            while self.entries and (
+                len(self.entries) > self.max_entries or self.bytes > self.max_bytes
+            ):
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted[2]
+                self.stats["evictions"] += 1
+
+
+_local_tiers = {}
+_local_tiers_lock = threading.Lock()
+
+
+def get_local_tier(l2_alias, channel, timeout, max_entries, max_bytes):
+    """Get the process-wide LocalTier of (l2_alias, channel), created on first use"""
+    key = (l2_alias, channel)
+    tier = _local_tiers.get(key)
+    if tier is None:
+        with _local_tiers_lock:
+            tier = _local_tiers.get(key)
+            if tier is None:
+                tier = _local_tiers[key] = LocalTier(
+                    l2_alias, channel, timeout, max_entries, max_bytes
+                )
+    return tier
+
+
+class TieredCache(BaseCache):
+    """In-process LRU/TTL cache (L1) in front of another cache alias (L2)
+
+    Writes go to L2, then the key is published on a redis channel that
+    every process subscribes to, so all L1 copies are dropped. An L1 entry
+    lives at most L1_TIMEOUT seconds, which bounds staleness even if an
+    invalidation is lost, and L1 is bypassed while the subscriber is not
+    connected. L1 and its subscriber are shared by the threads of a
+    process, see LocalTier. Values are returned from L1 as is, treat them
+    as read-only.
+
+    OPTIONS:
+        L2: alias of the backing django_redis cache, default "default"
+        L1_TIMEOUT: seconds an entry may be served from memory, default 5
+        L1_MAX_BYTES: memory bound of L1 by pickled size, default 16 MiB
+        CHANNEL: redis channel of invalidations
+    MAX_ENTRIES bounds the number of L1 entries, default 10000.
+    """
+
+    def __init__(self, server, params):
+        params = dict(params)
+        params.setdefault("OPTIONS", {}).setdefault("MAX_ENTRIES", 10000)
+        super().__init__(params)
+        options = params["OPTIONS"]
+        self._l2_alias = options.get("L2", "default")
+        self._local = get_local_tier(
+            self._l2_alias,
+            options.get("CHANNEL", "cache:invalidate"),
+            options.get("L1_TIMEOUT", 5),
+            self._max_entries,
+            options.get("L1_MAX_BYTES", 16 * 1024 * 1024),
+        )
+
+    @property
+    def l2(self):
+        return caches[self._l2_alias]
+
+    def _invalidate(self, keys):
+        """Drop keys from every L1, None drops everything"""
+        if keys is None:
+            self._local.clear()
+        else:
+            self._local.drop(keys)
+        client = self.l2.client.get_client(write=True)
+        client.publish(self._local.channel, json.dumps(keys))
+
+    @property
+    def generation(self):
+        """Changes on every invalidation, pass it to set_local()"""
+        return self._local.generation
+
+    def get_local(self, key, default=None, version=None):
+        """Get a value from L1 only, for callers that batch their own L2 reads"""
+        self._local.ensure_subscriber()
+        if not self._local.subscribed:
+            return default
+        value = self._local.get(self.make_key(key, version))
+        return default if value is _MISSING else value
+
+    def set_local(self, key, value, generation, version=None):
+        """Store a value read from L2 in L1, unless invalidated since `generation`"""
+        if self._local.subscribed:
+            self._local.set(self.make_key(key, version), value, generation)
+
+    # cache API, keys are passed to L2 unchanged
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        local = self._local
+        local.ensure_subscriber()
+        subscribed = local.subscribed
+        ret, missing = {}, []
+        for key in keys:
+            value = local.get(self.make_key(key, version)) if subscribed else _MISSING
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                ret[key] = value
+        if not missing:
+            return ret
+
+        # the L1 misses are read from L2 in one round trip
+        generation = local.generation
+        found = self.l2.get_many(missing, version)
+        local.l2_stats["hits"] += len(found)
+        local.l2_stats["misses"] += len(missing) - len(found)
+        if subscribed:
+            for key, value in found.items():
+                local.set(self.make_key(key, version), value, generation)
+        ret.update(found)
+        return ret
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version) is not _MISSING
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.l2.add(key, value, timeout, version)
+        if added:
+            self._invalidate([self.make_key(key, version)])
+        return added
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l2.set(key, value, timeout, version)
+        self._invalidate([self.make_key(key, version)])
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.l2.set_many(data, timeout, version)
+        self._invalidate([self.make_key(key, version) for key in data])
+        return failed
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        deleted = self.l2.delete(key, version)
+        self._invalidate([self.make_key(key, version)])
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self.l2.delete_many(keys, version)
+        self._invalidate([self.make_key(key, version) for key in keys])
+
+    def incr(self, key, delta=1, version=None):
+        value = self.l2.incr(key, delta, version)
+        self._invalidate([self.make_key(key, version)])
+        return value
+
+    def clear(self):
+        self.l2.clear()
+        self._invalidate(None)
+
+    def stats(self):
+        """Hit/miss counters of both tiers and the size of L1 in this process"""
+        local = self._local
+        return {
+            "l1": {
+                **local.stats,
+                "entries": len(local.entries),
+                "bytes": local.bytes,
+                "subscribed": local.subscribed,
+            },
+            "l2": dict(local.l2_stats),
+        }
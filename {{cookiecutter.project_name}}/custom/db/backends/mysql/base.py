@@ -0,0 +1,14 @@
+from django.db.backends.mysql import base
+
+from custom.db.pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    """MySQL backend with a connection pool, see PooledDatabaseWrapperMixin"""
+
+    def check_pooled_connection(self, connection):
+        connection.ping()
+
+    def reset_pooled_connection(self, connection):
+        if not connection.get_autocommit():
+            connection.rollback()
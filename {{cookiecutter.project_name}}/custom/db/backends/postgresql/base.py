@@ -0,0 +1,15 @@
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+from custom.db.pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    """PostgreSQL backend with a connection pool, see PooledDatabaseWrapperMixin"""
+
+    def reset_pooled_connection(self, connection):
+        status = connection.info.transaction_status
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            raise base.Database.InterfaceError("connection lost")
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            connection.rollback()
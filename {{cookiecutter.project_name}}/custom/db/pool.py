@@ -0,0 +1,281 @@
+import os
+import threading
+import time
+from collections import deque
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+
+class ConnectionPool:
+    """Bounded pool of DB-API connections shared by the threads of a process
+
+    Connections are borrowed for one request and handed back when Django
+    closes them. A connection idle for longer than `check_idle` seconds is
+    pinged before it is lent, so connections broken by a failover or an
+    idle timeout are replaced instead of failing the request.
+
+    Args:
+        min_size (int): idle connections kept open
+        max_size (int): connections open at most, borrowers wait beyond it
+        timeout (float): seconds to wait for a free connection
+        max_lifetime (float): seconds after which a connection is replaced
+        max_idle (float): seconds after which an idle connection above min_size is closed
+        check_idle (float): idle seconds after which a connection is pinged on borrow
+    """
+
+    def __init__(
+        self,
+        min_size=0,
+        max_size=10,
+        timeout=5,
+        max_lifetime=3600,
+        max_idle=600,
+        check_idle=0,
+    ):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_idle = check_idle
+        self._idle = deque()  # (connection, created, released)
+        self._created = {}  # id(connection) -> created, of borrowed connections
+        self._size = 0
+        self._cond = threading.Condition()
+        self.stats = dict.fromkeys(
+            (
+                "borrows",
+                "waits",
+                "timeouts",
+                "connects",
+                "closes",
+                "health_checks",
+                "health_check_failures",
+            ),
+            0,
+        )
+        self.stats.update(wait_total=0.0, wait_max=0.0)
+
+    def borrow(self, connect, check, error_class):
+        """Lend an idle connection, or open one with connect() if below max_size
+
+        Args:
+            connect (callable): opens a new connection
+            check (callable): raises if a connection is unusable
+            error_class (type): raised when no connection is free within timeout
+
+        Returns:
+            tuple: (connection, new), new is True for a just opened connection
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        with self._cond:
+            self.stats["borrows"] += 1
+            while True:
+                entry = self._pop_idle()
+                if entry is not None:
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats["timeouts"] += 1
+                    raise error_class(
+                        f"No database connection free within {self.timeout}s "
+                        f"({self.max_size} in use)"
+                    )
+                waited = True
+                self._cond.wait(remaining)
+            if waited:
+                duration = time.monotonic() - start
+                self.stats["waits"] += 1
+                self.stats["wait_total"] += duration
+                self.stats["wait_max"] = max(self.stats["wait_max"], duration)
+
+        if entry is not None:
+            connection, created, released = entry
+            if time.monotonic() - released < self.check_idle or self._check(
+                connection, check
+            ):
+                self._created[id(connection)] = created
+                return connection, False
+            self._discard(connection)
+            with self._cond:
+                self._size += 1  # reuse the slot for a new connection
+
+        try:
+            connection = connect()
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        self.stats["connects"] += 1
+        self._created[id(connection)] = time.monotonic()
+        return connection, True
+
+    def release(self, connection, reset):
+        """Take a connection back, it is closed if reset() fails or it is too old
+
+        Args:
+            connection: connection returned by borrow()
+            reset (callable): rolls back an open transaction, raises if broken
+        """
+        created = self._created.pop(id(connection), time.monotonic())
+        if time.monotonic() - created > self.max_lifetime:
+            self._discard(connection, notify=True)
+            return
+        try:
+            reset(connection)
+        except Exception:
+            self._discard(connection, notify=True)
+            return
+        with self._cond:
+            self._idle.append((connection, created, time.monotonic()))
+            self._cond.notify()
+
+    def _pop_idle(self):
+        # newest first, so surplus connections stay idle and expire
+        now = time.monotonic()
+        while self._idle:
+            connection, created, released = self._idle.pop()
+            if now - created > self.max_lifetime or (
+                now - released > self.max_idle and self._size > self.min_size
+            ):
+                self._size -= 1
+                self._close(connection)
+                continue
+            return connection, created, released
+        return None
+
+    def _check(self, connection, check):
+        self.stats["health_checks"] += 1
+        try:
+            check(connection)
+            return True
+        except Exception:
+            self.stats["health_check_failures"] += 1
+            return False
+
+    def _close(self, connection):
+        self.stats["closes"] += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _discard(self, connection, notify=False):
+        self._close(connection)
+        with self._cond:
+            self._size -= 1
+            if notify:
+                self._cond.notify()
+
+    def usage(self):
+        """Size, idle/in-use connections and counters of this pool"""
+        with self._cond:
+            idle = len(self._idle)
+            size = self._size
+        return {
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "size": size,
+            "idle": idle,
+            "in_use": size - idle,
+            **self.stats,
+        }
+
+
+def get_pool(alias, options):
+    """Get the process-wide pool of a database alias, created once per worker
+
+    Args:
+        alias (str): key of settings.DATABASES
+        options (dict): POOL of the database settings
+
+    Returns:
+        ConnectionPool: shared pool
+    """
+    global _pools_pid
+    pool = _pools.get(alias) if _pools_pid == os.getpid() else None
+    if pool is None:
+        with _pools_lock:
+            if _pools_pid != os.getpid():
+                # connections of the parent process must not be shared
+                _pools.clear()
+                _pools_pid = os.getpid()
+            pool = _pools.get(alias)
+            if pool is None:
+                pool = _pools[alias] = ConnectionPool(
+                    min_size=options.get("MIN_SIZE", 0),
+                    max_size=options.get("MAX_SIZE", 10),
+                    timeout=options.get("TIMEOUT", 5),
+                    max_lifetime=options.get("MAX_LIFETIME", 3600),
+                    max_idle=options.get("MAX_IDLE", 600),
+                    check_idle=options.get("CHECK_IDLE", 0),
+                )
+    return pool
+
+
+def pool_stats():
+    """Usage of every database pool in this process
+
+    Returns:
+        list: one dict per database alias
+    """
+    return [
+        {"pid": os.getpid(), "alias": alias, **pool.usage()}
+        for alias, pool in list(_pools.items())
+    ]
+
+
+class PooledDatabaseWrapperMixin:
+    """Mixin of a DatabaseWrapper that borrows its connection from a ConnectionPool
+
+    The database settings take a POOL dict (MIN_SIZE, MAX_SIZE, TIMEOUT,
+    MAX_LIFETIME, MAX_IDLE, CHECK_IDLE). CONN_MAX_AGE should be 0, so the
+    connection goes back to the pool at the end of every request. Session
+    state set by init_connection_state() is kept with the connection.
+    """
+
+    def get_new_connection(self, conn_params):
+        pool = get_pool(self.alias, self.settings_dict.get("POOL", {}))
+        connection, self._pooled_new = pool.borrow(
+            lambda: super(PooledDatabaseWrapperMixin, self).get_new_connection(
+                conn_params
+            ),
+            self.check_pooled_connection,
+            self.Database.OperationalError,
+        )
+        return connection
+
+    def init_connection_state(self):
+        if self._pooled_new:
+            super().init_connection_state()
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                get_pool(self.alias, self.settings_dict.get("POOL", {})).release(
+                    self.connection, self.reset_pooled_connection
+                )
+
+    def check_pooled_connection(self, connection):
+        """Raise if a connection is unusable, a backend may override it
+        with a cheaper ping
+        """
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT 1")
+        finally:
+            cursor.close()
+
+    def reset_pooled_connection(self, connection):
+        """Roll back a connection handed back to the pool, raise if it is broken,
+        a backend may override it to skip the rollback when no transaction is open
+        """
+        connection.rollback()
@@ -0,0 +1,143 @@
+import contextvars
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = "primary_pin"
+
+# alias the reads of the current request go to, None for the default database
+_read_database = contextvars.ContextVar("read_database", default=None)
+
+_healthy = []
+_next_check = 0.0
+_check_lock = threading.Lock()
+
+
+def replica_lag(alias):
+    """Replication delay of a replica in seconds, None if it is not replicating"""
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            # an idle primary sends no WAL, a replica that replayed all
+            # it received is not behind however old its last transaction is
+            cursor.execute(
+                "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()"
+                " THEN 0 ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())"
+                " END"
+            )
+            lag = cursor.fetchone()[0]
+        elif connection.vendor == "mysql":
+            cursor.execute("SHOW SLAVE STATUS")
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            columns = [column[0] for column in cursor.description]
+            lag = dict(zip(columns, row))["Seconds_Behind_Master"]
+        else:
+            return 0
+    return None if lag is None else float(lag)
+
+
+def healthy_replicas():
+    """Replicas within REPLICA_MAX_LAG, checked every REPLICA_LAG_CHECK_INTERVAL
+    seconds by one thread per process while the others use the last result
+    """
+    global _healthy, _next_check
+    now = time.monotonic()
+    if now >= _next_check and _check_lock.acquire(blocking=False):
+        try:
+            _next_check = now + settings.REPLICA_LAG_CHECK_INTERVAL
+            healthy = []
+            for alias in settings.DATABASE_REPLICAS:
+                try:
+                    lag = replica_lag(alias)
+                except DatabaseError as e:
+                    logger.warning("Replica %s is unreachable: %s", alias, e)
+                    continue
+                if lag is None or lag > settings.REPLICA_MAX_LAG:
+                    logger.warning("Replica %s is out of rotation, lag %s", alias, lag)
+                    continue
+                healthy.append(alias)
+            _healthy = healthy
+        finally:
+            _check_lock.release()
+    return _healthy
+
+
+def read_from_replica():
+    """Send the reads of the current context to a healthy replica, if any
+
+    Returns:
+        contextvars.Token: pass it to reset_reads()
+    """
+    replicas = healthy_replicas() if settings.DATABASE_REPLICAS else []
+    return _read_database.set(random.choice(replicas) if replicas else None)
+
+
+def current_read_database():
+    """Alias the reads of the current context go to, None for the default database"""
+    return _read_database.get()
+
+
+def reset_reads(token):
+    _read_database.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """Read from the default database inside the block"""
+    token = _read_database.set(None)
+    try:
+        yield
+    finally:
+        _read_database.reset(token)
+
+
+def _pin_key(user_id):
+    return f"replica:pin:{user_id}"
+
+
+def pin_primary(request, response, user=None):
+    """Keep the reads of a client on the primary for REPLICA_STICKY_SECONDS
+    after a write, by user in redis and by a cookie for the others
+    """
+    if user is not None and user.is_authenticated:
+        cache.set(_pin_key(user.pk), 1, settings.REPLICA_STICKY_SECONDS)
+    response.set_cookie(
+        PIN_COOKIE, "1", max_age=settings.REPLICA_STICKY_SECONDS, httponly=True
+    )
+
+
+def is_pinned(request, user=None):
+    """Whether the client wrote within REPLICA_STICKY_SECONDS"""
+    if PIN_COOKIE in request.COOKIES:
+        return True
+    return bool(
+        user is not None and user.is_authenticated and cache.get(_pin_key(user.pk))
+    )
+
+
+class ReplicaRouter:
+    """Route reads to the replica chosen by read_from_replica(), writes,
+    migrations and everything else to the default database
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
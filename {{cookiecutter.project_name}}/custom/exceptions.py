@@ -3,6 +3,16 @@ from rest_framework.views import exception_handler
 from rest_framework.views import Response
 from rest_framework import status
 
+# set by exception_handler from exc.auth_header and exc.wait
+EXCEPTION_HEADERS = ("WWW-Authenticate", "Retry-After")
+
+
+def exception_headers(response):
+    """Headers of an exception response that the envelope response must keep"""
+    return {
+        name: response[name] for name in EXCEPTION_HEADERS if response.has_header(name)
+    }
+
 
 def custom_exception_handler(exc, context):
     response = exception_handler(exc, context)
@@ -31,6 +41,7 @@ def custom_exception_handler(exc, context):
     return Response(
         {"code": error_code, "msg": error_msg},
         status=response.status_code,
+        headers=exception_headers(response),
         exception=True,
     )
 
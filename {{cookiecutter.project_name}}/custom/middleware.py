@@ -0,0 +1,159 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from rest_framework.permissions import SAFE_METHODS
+
+from custom.db.router import is_pinned, pin_primary, primary_reads, read_from_replica
+from utils import metrics
+
+# methods outside this set are labelled "other", clients send any method
+HTTP_METHODS = frozenset(
+    ("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "TRACE", "CONNECT")
+)
+
+
+def _record_query(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.record_db(time.perf_counter() - start)
+
+
+@receiver(connection_created, dispatch_uid="metrics_record_query")
+def _instrument_connection(sender, connection, **kwargs):
+    # installed on the connection rather than per request, under ASGI the
+    # queries run on the connections of the sync_to_async thread
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class MetricsMiddleware:
+    """Time every request, its database queries, redis round trips and rendering
+
+    The timings are aggregated per view into the histograms of utils.metrics,
+    served by custom.views.prometheus_metrics, and sent back in a Server-Timing
+    header when METRICS_SERVER_TIMING is set. Runs natively under WSGI and ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        for connection in connections.all(initialized_only=True):
+            _instrument_connection(None, connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        timings, token = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        self.record(request, response, timings, time.perf_counter() - start)
+        metrics.maybe_flush()
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        timings, token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        self.record(request, response, timings, time.perf_counter() - start)
+        if metrics.flush_due():
+            await sync_to_async(metrics.flush, thread_sensitive=False)()
+        return response
+
+    def record(self, request, response, timings, total):
+        match = request.resolver_match
+        labels = {
+            "method": request.method if request.method in HTTP_METHODS else "other",
+            "view": match.view_name if match else "unmatched",
+        }
+        metrics.observe("http_request_duration_seconds", labels, total)
+        metrics.observe("http_request_db_seconds", labels, timings.db_time)
+        metrics.observe("http_request_redis_seconds", labels, timings.redis_time)
+        metrics.observe("http_request_render_seconds", labels, timings.render_time)
+        metrics.increment("http_request_db_queries", labels, timings.db_count)
+        metrics.increment("http_request_redis_commands", labels, timings.redis_count)
+        metrics.increment("http_responses", {**labels, "status": response.status_code})
+
+        if settings.METRICS_SERVER_TIMING:
+            response["Server-Timing"] = (
+                f"total;dur={total * 1000:.1f}, "
+                f'db;dur={timings.db_time * 1000:.1f};desc="{timings.db_count} queries", '
+                f"redis;dur={timings.redis_time * 1000:.1f};"
+                f'desc="{timings.redis_count} round trips", '
+                f"render;dur={timings.render_time * 1000:.1f}"
+            )
+
+
+class ReplicaMiddleware:
+    """Read-your-writes for custom.db.router.ReplicaRouter
+
+    Clients that wrote are pinned to the primary for REPLICA_STICKY_SECONDS,
+    admin change lists are read from a replica otherwise. Views opt in
+    with custom.mixins.ReplicaReadMixin. Runs natively under WSGI and ASGI,
+    only writes and admin change lists wait on redis in a thread under ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with primary_reads():
+            response = self.get_response(request)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            pin_primary(request, response, getattr(request, "user", None))
+        return response
+
+    async def __acall__(self, request):
+        with primary_reads():
+            response = await self.get_response(request)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            await sync_to_async(pin_primary)(
+                request, response, getattr(request, "user", None)
+            )
+        return response
+
+    def is_admin_changelist(self, request):
+        match = request.resolver_match
+        return (
+            request.method in SAFE_METHODS
+            and match.namespace == "admin"
+            and (match.url_name or "").endswith("_changelist")
+        )
+
+    def read_changelist_from_replica(self, request):
+        if not is_pinned(request, request.user):
+            read_from_replica()  # reset when primary_reads() exits
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if self.is_admin_changelist(request):
+            self.read_changelist_from_replica(request)
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        if self.is_admin_changelist(request):
+            # sync_to_async copies the context variables set in the thread back
+            await sync_to_async(self.read_changelist_from_replica)(request)
@@ -0,0 +1,456 @@
+import hashlib
+from collections import Counter
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_save
+from django.http import StreamingHttpResponse
+from django.utils.translation import gettext_lazy as _
+from rest_framework import mixins, serializers
+from rest_framework.decorators import action
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+from custom.db.router import (
+    current_read_database,
+    is_pinned,
+    read_from_replica,
+    reset_reads,
+)
+from custom.exceptions import CustomAPIError
+from custom.renderers import stream_csv, stream_envelope, stream_gzip, stream_ndjson
+from utils.cache_version import get_versions, version_key
+from utils.cfg import to_bool
+
+
+def get_related_lookups(serializer, prefix=""):
+    """Return (select_related, prefetch_related) lookups of the fields a
+    serializer renders, nested serializers included
+    """
+    select, prefetch = [], []
+    for field in serializer._readable_fields:
+        if field.source == "*" or "." in field.source:
+            continue
+        source = prefix + field.source
+        if isinstance(
+            field, (serializers.ManyRelatedField, serializers.ListSerializer)
+        ):
+            prefetch.append(source)
+            if isinstance(field, serializers.ListSerializer):
+                prefetch.extend(
+                    sum(get_related_lookups(field.child, source + "__"), [])
+                )
+        elif isinstance(field, serializers.BaseSerializer):
+            select.append(source)
+            nested_select, nested_prefetch = get_related_lookups(field, source + "__")
+            select.extend(nested_select)
+            prefetch.extend(nested_prefetch)
+        elif isinstance(field, serializers.RelatedField) and not isinstance(
+            field, serializers.PrimaryKeyRelatedField
+        ):
+            # a primary key is read from the local `<name>_id` column
+            select.append(source)
+    return select, prefetch
+
+
+class AutoPrefetchMixin:
+    """Add select_related/prefetch_related for the relations the serializer
+    renders, so a list page costs the same number of queries for any size
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        select, prefetch = get_related_lookups(self.get_serializer())
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+
+class ValuesListModelMixin(mixins.ListModelMixin):
+    """List through the `.values()` fast path of a ValuesSerializerMixin
+    serializer, falls back to the regular list when it is not supported
+    """
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_serializer()
+        if not hasattr(serializer, "get_values_queryset"):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        queryset = serializer.get_values_queryset(queryset)
+        if queryset is None:
+            return super().list(request, *args, **kwargs)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(
+                serializer.values_to_representation(page)
+            )
+        return Response(serializer.values_to_representation(list(queryset)))
+
+
+class StreamingListModelMixin(mixins.ListModelMixin):
+    """List with `?stream=true` streams every row in the usual envelope,
+    rows are read by a queryset iterator so worker memory stays flat
+    """
+
+    stream_param = "stream"
+    stream_chunk_size = 2000
+
+    def list(self, request, *args, **kwargs):
+        if not to_bool(request.query_params.get(self.stream_param)):
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = self.get_serializer()
+        rows = (
+            serializer.to_representation(instance)
+            for instance in queryset.iterator(chunk_size=self.stream_chunk_size)
+        )
+        return StreamingHttpResponse(
+            stream_envelope(rows), content_type="application/json"
+        )
+
+
+class CachedResponseMixin:
+    """Cache the data of `retrieve` and `list` responses in redis
+
+    Keys hold version counters instead of being deleted: a retrieve depends
+    on the object's counter, a list on the collection counter of the model,
+    both also on the counters of `cache_dependencies`. Bumping a counter
+    (see core.signals) invalidates every response built on it in O(1).
+    Keys are per viewer and include the viewer's own counter, a hit only
+    replays a response the same user was allowed to see, and the viewer's
+    permissions have not changed since. Responses read from a replica are
+    cached for a few seconds only, see get_cache_timeout().
+    """
+
+    cache_timeout = settings.RESPONSE_CACHE_TIMEOUT
+    cache_dependencies = ()
+
+    def get_cache_model(self):
+        if self.queryset is not None:
+            return self.queryset.model
+        return self.get_queryset().model
+
+    def get_cache_versions(self, request, pk=None):
+        model = self.get_cache_model()
+        keys = [version_key(model, pk)]
+        keys += [version_key(dependency) for dependency in self.cache_dependencies]
+        if request.user.is_authenticated:
+            keys.append(version_key(type(request.user), request.user.pk))
+        return get_versions(keys)
+
+    def get_cache_key(self, request, pk=None):
+        viewer = request.user.pk if request.user.is_authenticated else "anon"
+        versions = ".".join(str(v) for v in self.get_cache_versions(request, pk))
+        path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        return f"response:{self.basename}:{self.action}:{viewer}:{path}:{versions}"
+
+    def cached(self, request, pk, handler):
+        if not self.cache_timeout:
+            return handler()
+        key = self.get_cache_key(request, pk)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = handler()
+        if isinstance(response, Response) and response.status_code == 200:
+            cache.set(key, response.data, self.get_cache_timeout())
+        return response
+
+    def get_cache_timeout(self):
+        if current_read_database() is None:
+            return self.cache_timeout
+        # a replica may not have the write that bumped the versions yet, its
+        # responses are dropped once the lag check would have caught up
+        replica_timeout = settings.REPLICA_MAX_LAG + settings.REPLICA_LAG_CHECK_INTERVAL
+        return min(self.cache_timeout, max(1, int(replica_timeout)))
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        handler = partial(super().retrieve, request, *args, **kwargs)
+        pk_field = self.get_cache_model()._meta.pk
+        # objects looked up by another field only depend on the collection
+        if self.lookup_field in ("pk", pk_field.name):
+            # the counter bumped by signals is keyed by the pk value, "01" is 1
+            try:
+                pk = pk_field.to_python(self.kwargs[lookup])
+            except ValidationError:
+                return handler()
+        else:
+            pk = None
+        return self.cached(request, pk, handler)
+
+    def list(self, request, *args, **kwargs):
+        handler = partial(super().list, request, *args, **kwargs)
+        return self.cached(request, None, handler)
+
+
+class ReplicaReadMixin:
+    """Read safe-method requests from a replica of custom.db.router
+
+    Clients pinned after a write read from the primary. Querysets are bound
+    to the chosen replica, so streamed responses keep reading from it.
+    """
+
+    _replica_token = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (
+            settings.DATABASE_REPLICAS
+            and request.method in SAFE_METHODS
+            and not is_pinned(request, request.user)
+        ):
+            self._replica_token = read_from_replica()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        alias = current_read_database()
+        return queryset.using(alias) if alias else queryset
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if self._replica_token is not None:
+            reset_reads(self._replica_token)
+            self._replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    """Accept any Accept header, for actions that render their own content type"""
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class ExportMixin:
+    """`export` action that streams every row of the list queryset as
+    NDJSON, or CSV with `?output=csv`, gzip-compressed when accepted
+
+    Rows are read by a server-side cursor and, for ValuesSerializerMixin
+    serializers, projected with `.values()`, so memory stays flat for any
+    number of rows.
+    """
+
+    export_chunk_size = 2000
+    export_formats = {
+        "ndjson": (stream_ndjson, "application/x-ndjson"),
+        "csv": (stream_csv, "text/csv; charset=utf-8"),
+    }
+
+    def get_export_rows(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = self.get_serializer()
+        values = None
+        if hasattr(serializer, "get_values_queryset"):
+            values = serializer.get_values_queryset(queryset.prefetch_related(None))
+        if values is None:
+            for instance in queryset.iterator(chunk_size=self.export_chunk_size):
+                yield serializer.to_representation(instance)
+            return
+
+        # many-to-many ids are read once per chunk of rows
+        chunk = []
+        for row in values.iterator(chunk_size=self.export_chunk_size):
+            chunk.append(row)
+            if len(chunk) >= self.export_chunk_size:
+                yield from serializer.values_to_representation(chunk)
+                chunk = []
+        if chunk:
+            yield from serializer.values_to_representation(chunk)
+
+    @action(
+        detail=False,
+        methods=["get"],
+        content_negotiation_class=IgnoreClientContentNegotiation,
+    )
+    def export(self, request, *args, **kwargs):
+        output = request.query_params.get("output", "ndjson")
+        if output not in self.export_formats:
+            raise CustomAPIError(_("Unsupported export format"))
+        encode, content_type = self.export_formats[output]
+
+        content = encode(self.get_export_rows())
+        gzip = "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", "")
+        if gzip:
+            content = stream_gzip(content)
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response[
+            "Content-Disposition"
+        ] = f'attachment; filename="{self.basename}.{output}"'
+        response["Vary"] = "Accept-Encoding"
+        if gzip:
+            response["Content-Encoding"] = "gzip"
+        return response
+
+
+class BatchMixin:
+    """`batch` action, one request instead of one per object
+
+    GET /batch/?ids=3,1,2 returns the objects in the given order from one
+    in_bulk query, ids that do not exist or are not visible are listed in
+    `missing`. PATCH /batch/ with [{"id": 1, ...}, ...] applies partial
+    updates in one transaction with bulk_update, after the object
+    permissions of every object are checked. post_save is sent for each
+    updated object so signal receivers (caches) stay consistent.
+
+    Items are validated by `batch_serializer_class`, only its writable
+    concrete fields can be updated, any other key is rejected. Keep
+    passwords, permissions and many-to-many fields out of it.
+    """
+
+    batch_max_size = 100
+    batch_serializer_class = None
+
+    def get_batch_serializer(self, *args, **kwargs):
+        assert self.batch_serializer_class is not None, (
+            "'%s' should include a `batch_serializer_class` attribute."
+            % self.__class__.__name__
+        )
+        kwargs.setdefault("context", self.get_serializer_context())
+        return self.batch_serializer_class(*args, **kwargs)
+
+    def get_batch_fields(self, serializer):
+        """Names of the fields an item may update"""
+        opts = serializer.Meta.model._meta
+        fields = set()
+        for name, field in serializer.fields.items():
+            if field.read_only:
+                continue
+            try:
+                model_field = opts.get_field(field.source)
+            except FieldDoesNotExist:
+                continue
+            if model_field.concrete and not model_field.many_to_many:
+                fields.add(name)
+        return fields
+
+    def get_batch_ids(self, ids):
+        field = serializers.ListField(
+            child=serializers.IntegerField(min_value=1),
+            allow_empty=False,
+            max_length=self.batch_max_size,
+        )
+        try:
+            return field.run_validation(ids)
+        except serializers.ValidationError as e:
+            detail = e.detail
+            if isinstance(detail, dict):  # errors of one item
+                detail = next(iter(detail.values()))
+            raise serializers.ValidationError({"ids": detail})
+
+    @action(detail=False, methods=["get"])
+    def batch(self, request, *args, **kwargs):
+        ids = self.get_batch_ids(request.query_params.get("ids", "").split(","))
+        instances = self.filter_queryset(self.get_queryset()).in_bulk(ids)
+        for instance in instances.values():
+            self.check_object_permissions(request, instance)
+        serializer = self.get_serializer(
+            [instances[pk] for pk in ids if pk in instances], many=True
+        )
+        missing = [pk for pk in ids if pk not in instances]
+        return Response({"results": serializer.data, "missing": missing})
+
+    @batch.mapping.patch
+    def batch_update(self, request, *args, **kwargs):
+        if not isinstance(request.data, list) or not all(
+            isinstance(item, dict) for item in request.data
+        ):
+            raise serializers.ValidationError(
+                {"ids": [_("Expected a list of objects")]}
+            )
+        ids = self.get_batch_ids([item.get("id") for item in request.data])
+        duplicates = sorted(pk for pk, count in Counter(ids).items() if count > 1)
+        if duplicates:
+            raise serializers.ValidationError(
+                {"ids": [_("Duplicate ids: %(ids)s") % {"ids": duplicates}]}
+            )
+        allowed = self.get_batch_fields(self.get_batch_serializer())
+        for pk, item in zip(ids, request.data):
+            rejected = sorted(item.keys() - allowed - {"id"})
+            if rejected:
+                raise serializers.ValidationError(
+                    {f"{pk}.{rejected[0]}": [_("This field cannot be batch updated.")]}
+                )
+
+        try:
+            with transaction.atomic():
+                updated = self.apply_batch_update(request, ids)
+        except IntegrityError:
+            # a concurrent write took a unique value after it was validated
+            raise serializers.ValidationError(
+                {"ids": [_("A unique value is already taken, please retry")]}
+            )
+        return Response({"results": self.get_serializer(updated, many=True).data})
+
+    def apply_batch_update(self, request, ids):
+        queryset = self.filter_queryset(self.get_queryset())
+        instances = queryset.select_for_update().in_bulk(ids)
+        missing = [pk for pk in ids if pk not in instances]
+        if missing:
+            raise serializers.ValidationError(
+                {"ids": [_("Not found: %(ids)s") % {"ids": missing}]}
+            )
+
+        serializers_ = []
+        for pk, item in zip(ids, request.data):
+            instance = instances[pk]
+            self.check_object_permissions(request, instance)
+            serializer = self.get_batch_serializer(instance, data=item, partial=True)
+            if not serializer.is_valid():
+                field, errors = next(iter(serializer.errors.items()))
+                raise serializers.ValidationError({f"{pk}.{field}": errors})
+            serializers_.append(serializer)
+        self.check_batch_unique(serializers_)
+
+        updated, fields = [], set()
+        for serializer in serializers_:
+            instance = serializer.instance
+            for attr, value in serializer.validated_data.items():
+                setattr(instance, attr, value)
+                fields.add(attr)
+            updated.append(instance)
+        self.perform_batch_update(updated, sorted(fields))
+        return updated
+
+    def check_batch_unique(self, serializers_):
+        """Reject a unique value set on two objects of the batch, the
+        serializer's validators only compare it with the stored rows
+        """
+        seen = set()
+        for serializer in serializers_:
+            instance = serializer.instance
+            for attr, value in serializer.validated_data.items():
+                if value in (None, "") or not instance._meta.get_field(attr).unique:
+                    continue
+                if (attr, value) in seen:
+                    raise serializers.ValidationError(
+                        {
+                            f"{instance.pk}.{attr}": [
+                                _("This value is set on another object of the batch.")
+                            ]
+                        }
+                    )
+                seen.add((attr, value))
+
+    def perform_batch_update(self, instances, fields):
+        if fields:
+            instances[0]._meta.model.objects.bulk_update(instances, fields)
+        for instance in instances:
+            post_save.send(
+                sender=type(instance),
+                instance=instance,
+                created=False,
+                raw=False,
+                using=instance._state.db,
+                update_fields=frozenset(fields),
+            )
@@ -0,0 +1,111 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+class KeysetPagination(CursorPagination):
+    """Cursor pagination on the primary key, every page is an indexed range
+    scan instead of an OFFSET, so deep pages are as fast as the first one
+
+    The optional total `count` depends on `count_mode`:
+        none: no count
+        approximate: table statistics of postgres/mysql for unfiltered
+            querysets, cached count otherwise
+        cached: COUNT(*) cached in redis, a stale count is served while
+            one background thread refreshes it
+    """
+
+    ordering = "-id"
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    count_mode = settings.PAGINATION_COUNT
+    count_timeout = settings.PAGINATION_COUNT_TIMEOUT
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = self.get_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        ret = OrderedDict()
+        if self.count is not None:
+            ret["count"] = self.count
+        ret["next"] = self.get_next_link()
+        ret["previous"] = self.get_previous_link()
+        ret["results"] = data
+        return Response(ret)
+
+    def get_paginated_response_schema(self, schema):
+        ret = super().get_paginated_response_schema(schema)
+        ret["properties"] = {
+            "count": {"type": "integer", "example": 123},
+            **ret["properties"],
+        }
+        return ret
+
+    def get_count(self, queryset):
+        if self.count_mode == "approximate":
+            count = self.get_approximate_count(queryset)
+            if count is not None:
+                return count
+        if self.count_mode in ("approximate", "cached"):
+            return self.get_cached_count(queryset)
+        return None
+
+    def get_approximate_count(self, queryset):
+        if queryset.query.where:
+            return None
+        connection = connections[queryset.db]
+        table = queryset.model._meta.db_table
+        if connection.vendor == "postgresql":
+            sql = "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass"
+        elif connection.vendor == "mysql":
+            sql = (
+                "SELECT TABLE_ROWS FROM information_schema.TABLES "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s"
+            )
+        else:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+        # reltuples is -1 before the first ANALYZE
+        if not row or row[0] is None or row[0] < 0:
+            return None
+        return int(row[0])
+
+    def get_cached_count(self, queryset):
+        sql = str(queryset.query.sql_with_params()).encode()
+        key = f"pagination:count:{hashlib.md5(sql).hexdigest()}"
+        cached = cache.get(key)
+        if cached is None:
+            return self.refresh_count(queryset, key)
+
+        count, refreshed = cached
+        if time.time() - refreshed > self.count_timeout and cache.add(
+            f"{key}:lock", 1, self.count_timeout
+        ):
+            threading.Thread(
+                target=self.refresh_count_in_background,
+                args=(queryset.all(), key),
+                daemon=True,
+            ).start()
+        return count
+
+    def refresh_count(self, queryset, key):
+        count = queryset.count()
+        cache.set(key, (count, time.time()), self.count_timeout * 10)
+        return count
+
+    def refresh_count_in_background(self, queryset, key):
+        try:
+            self.refresh_count(queryset, key)
+        finally:
+            connections.close_all()
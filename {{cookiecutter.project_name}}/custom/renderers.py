@@ -1,17 +1,139 @@
+import csv
+import io
+import json
+import time
+import zlib
+
 from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from utils import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = JSONEncoder()
+
+
+def dumps(data):
+    """Serialize data to compact utf-8 json bytes, with orjson when it is installed,
+    types orjson does not know (Decimal, lazy strings...) go through DRF's JSONEncoder
+
+    OPT_UTC_Z writes UTC datetimes with a "Z" like DRF's JSONEncoder. Floats
+    may be spelled differently (1e16 and 1e+16), they parse to the same value.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(
+                data,
+                default=_encoder.default,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z,
+            )
+        except TypeError:
+            pass
+    return json.dumps(
+        data, cls=JSONEncoder, ensure_ascii=False, separators=(",", ":")
+    ).encode()
+
+
+def _escape(ret):
+    # same as JSONRenderer, escape the line terminators that are invalid in javascript
+    return ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+
+
+def render_envelope(code, msg, data):
+    """Render the {code,msg,data} envelope, data itself is referenced, never copied"""
+    return _escape(dumps({"code": code, "msg": msg, "data": data}))
 
 
 class CustomRenderer(JSONRenderer):
     def render(self, data, accepted_media_type=None, renderer_context=None):
+        start = time.perf_counter()
+        try:
+            return self._render(data, accepted_media_type, renderer_context)
+        finally:
+            metrics.record_render(time.perf_counter() - start)
+
+    def _render(self, data, accepted_media_type=None, renderer_context=None):
         if renderer_context:
             if isinstance(data, list):
-                res = {"code": 200, "msg": "success", "data": data}
+                code, msg = 200, "success"
             else:
-                res = {}
                 if not data:
                     data = {}
-                res["code"] = data.pop("code", 200)
-                res["msg"] = data.pop("msg", "success")
-                res["data"] = data
+                code = data.get("code", 200)
+                msg = data.get("msg", "success")
+                if "code" in data or "msg" in data:
+                    data = {k: v for k, v in data.items() if k not in ("code", "msg")}
+            if self.get_indent(accepted_media_type, renderer_context) is None:
+                return render_envelope(code, msg, data)
+            res = {"code": code, "msg": msg, "data": data}
             return super().render(res, accepted_media_type, renderer_context)
         return super().render(data, accepted_media_type, renderer_context)
+
+
+def stream_envelope(rows, code=200, msg="success", chunk_size=100):
+    """Yield the {code,msg,data:[...]} envelope of rows piece by piece,
+    only chunk_size rendered rows are held in memory at a time
+    """
+    head = render_envelope(code, msg, [])
+    yield head[:-2]
+    chunk = []
+    separator = b""
+    for row in rows:
+        chunk.append(dumps(row))
+        if len(chunk) >= chunk_size:
+            yield separator + _escape(b",".join(chunk))
+            chunk, separator = [], b","
+    if chunk:
+        yield separator + _escape(b",".join(chunk))
+    yield b"]}"
+
+
+def stream_ndjson(rows, chunk_size=100):
+    """Yield rows as newline-delimited json, chunk_size rows per piece"""
+    chunk = []
+    for row in rows:
+        chunk.append(dumps(row))
+        if len(chunk) >= chunk_size:
+            yield b"\n".join(chunk) + b"\n"
+            chunk = []
+    if chunk:
+        yield b"\n".join(chunk) + b"\n"
+
+
+def _csv_value(value):
+    if isinstance(value, (list, dict)):
+        return dumps(value).decode()
+    return value
+
+
+def stream_csv(rows, chunk_size=100):
+    """Yield rows as csv with a header of the first row's keys,
+    list and dict values are written as json
+    """
+    buffer = io.StringIO()
+    writer = None
+    for count, row in enumerate(rows, 1):
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(row))
+            writer.writeheader()
+        writer.writerow({k: _csv_value(v) for k, v in row.items()})
+        if count % chunk_size == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def stream_gzip(chunks, level=6):
+    """Gzip a byte stream on the fly"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
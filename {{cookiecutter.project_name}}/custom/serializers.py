@@ -0,0 +1,110 @@
+from collections import defaultdict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from rest_framework import serializers
+from rest_framework.relations import PKOnlyObject
+
+
+class ValuesSerializerMixin:
+    """Read-only fast path of a ModelSerializer that builds the output
+    from `.values()` rows, without creating a model instance per row
+
+    Concrete model fields and foreign key ids are read by `.values()`,
+    many-to-many primary keys by one query on the through table.
+    Serializers with any other readable field do not support the fast path.
+    """
+
+    def get_values_plan(self):
+        """Return [(serializer field, model field)] in output order,
+        or None when a readable field needs a model instance
+        """
+        if hasattr(self, "_values_plan"):
+            return self._values_plan
+
+        opts = self.Meta.model._meta
+        plan = []
+        self._values_plan = None
+        for field in self._readable_fields:
+            try:
+                model_field = opts.get_field(field.source)
+            except FieldDoesNotExist:
+                return None
+            if isinstance(field, serializers.ManyRelatedField):
+                if not (
+                    isinstance(field.child_relation, serializers.PrimaryKeyRelatedField)
+                    and isinstance(model_field, models.ManyToManyField)
+                ):
+                    return None
+                plan.append((field, model_field))
+            elif model_field.is_relation:
+                if not (
+                    isinstance(field, serializers.PrimaryKeyRelatedField)
+                    and model_field.concrete
+                    and not model_field.many_to_many
+                ):
+                    return None
+                plan.append((field, model_field))
+            elif model_field.concrete:
+                plan.append((field, model_field))
+            else:
+                return None
+        self._values_plan = plan
+        return plan
+
+    def get_values_queryset(self, queryset):
+        """Return queryset.values() of the serializer fields, or None if unsupported"""
+        plan = self.get_values_plan()
+        if plan is None:
+            return None
+        names = {
+            model_field.attname
+            for _, model_field in plan
+            if not model_field.many_to_many
+        }
+        names.add(queryset.model._meta.pk.attname)
+        return queryset.values(*names)
+
+    def values_to_representation(self, rows):
+        """Represent the rows of get_values_queryset() like to_representation() would"""
+        fields = self.get_values_plan()
+        pk_name = self.Meta.model._meta.pk.attname
+        related = {}
+        for field, model_field in fields:
+            if not model_field.many_to_many:
+                continue
+            source = model_field.m2m_field_name()
+            target = model_field.m2m_reverse_field_name()
+            pairs = (
+                model_field.remote_field.through.objects.filter(
+                    **{f"{source}__in": [row[pk_name] for row in rows]}
+                )
+                .order_by("pk")
+                .values_list(f"{source}_id", f"{target}_id")
+            )
+            ids = defaultdict(list)
+            for pk, related_pk in pairs:
+                ids[pk].append(related_pk)
+            related[field.field_name] = ids
+
+        ret = []
+        for row in rows:
+            item = {}
+            for field, model_field in fields:
+                if field.field_name in related:
+                    item[field.field_name] = [
+                        field.child_relation.to_representation(PKOnlyObject(pk=pk))
+                        for pk in related[field.field_name][row[pk_name]]
+                    ]
+                    continue
+                value = row[model_field.attname]
+                if value is None:
+                    item[field.field_name] = None
+                    continue
+                if model_field.is_relation:
+                    value = PKOnlyObject(pk=value)
+                elif isinstance(model_field, models.FileField):
+                    value = model_field.attr_class(None, model_field, value)
+                item[field.field_name] = field.to_representation(value)
+            ret.append(item)
+        return ret
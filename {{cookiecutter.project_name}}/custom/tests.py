@@ -0,0 +1,83 @@
+import datetime
+import decimal
+import json
+import uuid
+from unittest import TestCase
+from zoneinfo import ZoneInfo
+
+from asgiref.sync import async_to_sync
+from django.test import RequestFactory
+from rest_framework.permissions import AllowAny
+from rest_framework.throttling import BaseThrottle
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.views import APIView
+
+from custom.renderers import dumps
+from custom.views import AsyncAPIView
+
+
+def drf_dumps(value):
+    return json.dumps(value, cls=JSONEncoder, ensure_ascii=False, separators=(",", ":"))
+
+
+class DumpsTests(TestCase):
+    def test_same_output_as_drf_encoder(self):
+        values = [
+            datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc),
+            datetime.datetime(2023, 1, 1, 1, 2, 3, 4, tzinfo=ZoneInfo("UTC")),
+            datetime.datetime(2023, 7, 1, tzinfo=ZoneInfo("Europe/London")),
+            datetime.datetime(2023, 1, 1, 8, tzinfo=ZoneInfo("Asia/Shanghai")),
+            datetime.datetime(2023, 1, 1, 1, 2, 3, 500),
+            datetime.date(2023, 1, 2),
+            datetime.time(1, 2, 3, 5),
+            datetime.timedelta(seconds=3),
+            decimal.Decimal("1.10"),
+            uuid.UUID("b5b99eef-9c3c-4c4f-b4ba-4bbb8e8650bf"),
+            {1: "一", "2": [None, True]},
+        ]
+        for value in values:
+            self.assertEqual(dumps(value).decode(), drf_dumps(value))
+
+    def test_same_floats_as_drf_encoder(self):
+        # the spelling of floats differs between orjson and json, not their value
+        for value in (0.1, 1e16, 1.5e-7, -2.0, {"float": 1e16}):
+            self.assertEqual(json.loads(dumps(value)), json.loads(drf_dumps(value)))
+
+
+class DenyThrottle(BaseThrottle):
+    def allow_request(self, request, view):
+        return False
+
+    async def aallow_request(self, request, view):
+        return False
+
+    def wait(self):
+        return 30
+
+
+class ThrottledView(APIView):
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    throttle_classes = [DenyThrottle]
+
+    def post(self, request):
+        return {}
+
+
+class AsyncThrottledView(AsyncAPIView):
+    throttle_classes = [DenyThrottle]
+
+    async def post(self, request):
+        return {}
+
+
+class ExceptionHeadersTests(TestCase):
+    def test_retry_after(self):
+        request = RequestFactory().post("/")
+        for response in (
+            ThrottledView.as_view()(request).render(),
+            async_to_sync(AsyncThrottledView.as_view())(request),
+        ):
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response["Retry-After"], "30")
+            self.assertEqual(json.loads(response.content)["code"], 429)
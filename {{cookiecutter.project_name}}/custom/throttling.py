@@ -0,0 +1,122 @@
+import uuid
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from utils.redis_func import AsyncClient as AsyncRedisClient, Client as RedisClient
+from utils.verify import PHONE_PATTERN
+
+# KEYS: one sorted set of request timestamps per ident
+# ARGV: request id, then for every key the number of its windows
+#       followed by that many (limit, seconds) pairs
+SLIDING_WINDOW_SCRIPT = """
+local t = redis.call("TIME")
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local idx = 2
+local wait = 0
+local longest = {}
+for i, key in ipairs(KEYS) do
+    longest[i] = 0
+    for _ = 1, tonumber(ARGV[idx]) do
+        local limit = tonumber(ARGV[idx + 1])
+        local window = tonumber(ARGV[idx + 2])
+        idx = idx + 2
+        if window > longest[i] then
+            longest[i] = window
+        end
+        local count = redis.call("ZCOUNT", key, "(" .. (now - window), "+inf")
+        if count >= limit then
+            local oldest = redis.call(
+                "ZRANGEBYSCORE", key, "(" .. (now - window), "+inf",
+                "WITHSCORES", "LIMIT", count - limit, 1
+            )
+            wait = math.max(wait, tonumber(oldest[2]) + window - now)
+        end
+    end
+    idx = idx + 1
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    redis.call("ZREMRANGEBYSCORE", key, "-inf", now - longest[i])
+    redis.call("ZADD", key, now, ARGV[1])
+    redis.call("EXPIRE", key, math.ceil(longest[i]))
+end
+return "0"
+"""
+
+
+class RedisScopedThrottle(BaseThrottle):
+    """Sliding-window throttle shared by every worker and node through redis
+
+    Like DRF's ScopedRateThrottle the view sets `throttle_scope`, the windows
+    of that scope are read from `settings.THROTTLE_RATES`:
+
+        THROTTLE_RATES = {
+            "verification": {
+                "phone": [(1, 120), (10, 86400)],  # (requests, seconds)
+                "ip": [(5, 60)],
+                "global": [(60, 60)],
+            }
+        }
+
+    Every ident (phone, ip, global) and all of its windows are checked
+    and recorded by one lua script call, using the redis server clock.
+    The phone is trimmed like the serializer's CharField does, requests
+    without a valid phone only count against the ip windows. The ip is
+    read from X-Forwarded-For behind REST_FRAMEWORK["NUM_PROXIES"] proxies.
+    """
+
+    scope_attr = "throttle_scope"
+
+    def __init__(self):
+        self.retry_after = None
+
+    def get_idents(self, request, view):
+        idents = {"ip": self.get_ident(request)}
+        phone = request.data.get("phone") if hasattr(request.data, "get") else None
+        if isinstance(phone, str) and PHONE_PATTERN.match(phone.strip()):
+            idents["phone"] = phone.strip()
+            idents["global"] = "all"
+        return idents
+
+    def get_script_args(self, request, view):
+        """Return the (keys, args) of SLIDING_WINDOW_SCRIPT, None if nothing is throttled"""
+        scope = getattr(view, self.scope_attr, None)
+        rates = settings.THROTTLE_RATES.get(scope)
+        if not rates:
+            return None
+
+        idents = self.get_idents(request, view)
+        keys, args = [], [uuid.uuid4().hex]
+        for name, windows in rates.items():
+            if name not in idents or not windows:
+                continue
+            keys.append(f"throttle:{scope}:{name}:{idents[name]}")
+            args.append(len(windows))
+            for limit, duration in windows:
+                args += [limit, duration]
+        return (keys, args) if keys else None
+
+    def allow_request(self, request, view):
+        script_args = self.get_script_args(request, view)
+        if script_args is None:
+            return True
+        keys, args = script_args
+        script = RedisClient().register_script(SLIDING_WINDOW_SCRIPT)
+        self.retry_after = float(script(keys=keys, args=args))
+        return self.retry_after <= 0
+
+    async def aallow_request(self, request, view):
+        """allow_request() for async views, see custom.views.AsyncAPIView"""
+        script_args = self.get_script_args(request, view)
+        if script_args is None:
+            return True
+        keys, args = script_args
+        script = AsyncRedisClient().register_script(SLIDING_WINDOW_SCRIPT)
+        self.retry_after = float(await script(keys=keys, args=args))
+        return self.retry_after <= 0
+
+    def wait(self):
+        return self.retry_after
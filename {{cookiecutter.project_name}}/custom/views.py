@@ -0,0 +1,92 @@
+import asyncio
+import hmac
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.views import View
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from custom.exceptions import custom_exception_handler, exception_headers
+from custom.renderers import CustomRenderer
+from utils import metrics
+
+
+class AsyncAPIView(View):
+    """APIView counterpart for coroutine handlers, served by an ASGI server
+
+    Handlers are `async def post(self, request)` returning the response data,
+    which is rendered in the {code,msg,data} envelope of CustomRenderer,
+    errors go through custom_exception_handler like in APIView. There is
+    no authentication or permission check, throttle_classes must implement
+    aallow_request(). The ORM is synchronous, wrap queries in sync_to_async.
+    """
+
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES
+    throttle_classes = []
+    serializer_class = None
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # same as APIView, csrf_exempt() would hide that the view is async
+        view.csrf_exempt = True
+        return view
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault("context", {"request": self.request, "view": self})
+        return self.serializer_class(*args, **kwargs)
+
+    async def check_throttles(self, request):
+        durations = []
+        for throttle in [throttle() for throttle in self.throttle_classes]:
+            if not await throttle.aallow_request(request, self):
+                durations.append(throttle.wait())
+        if durations:
+            durations = [duration for duration in durations if duration is not None]
+            raise exceptions.Throttled(max(durations, default=None))
+
+    def finalize_response(self, data, status=200, headers=None):
+        content = CustomRenderer().render(data, renderer_context={"view": self})
+        return HttpResponse(
+            content, status=status, headers=headers, content_type="application/json"
+        )
+
+    async def dispatch(self, request, *args, **kwargs):
+        handler = getattr(self, request.method.lower(), None)
+        if request.method.lower() not in self.http_method_names or not (
+            asyncio.iscoroutinefunction(handler)
+        ):
+            # 405 and OPTIONS
+            return await super().dispatch(request, *args, **kwargs)
+
+        request = Request(request, parsers=[parser() for parser in self.parser_classes])
+        self.request = request
+        try:
+            await self.check_throttles(request)
+            data = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = custom_exception_handler(exc, {"view": self, "request": request})
+            # Retry-After of Throttled, like APIView
+            return self.finalize_response(
+                response.data, response.status_code, exception_headers(response)
+            )
+        return self.finalize_response(data)
+
+
+def prometheus_metrics(request):
+    """Metrics of utils.metrics for Prometheus, scraped with
+    `Authorization: Bearer <METRICS_TOKEN>`, disabled while the token is not set
+    """
+    token = settings.METRICS_TOKEN
+    if not token:
+        raise Http404
+    if not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        return HttpResponse(status=401)
+    metrics.flush()
+    return HttpResponse(
+        metrics.render_prometheus(), content_type="text/plain; version=0.0.4"
+    )
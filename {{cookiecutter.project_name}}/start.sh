@@ -4,7 +4,25 @@ set -a
 source .env
 set +a
 
+# sh start.sh worker <queue> [--concurrency N]
+if [ "$1" = "worker" ]; then
+    shift
+    exec python manage.py worker "$@"
+fi
+
 python manage.py collectstatic --noinput
 python manage.py migrate
 
+# SERVER=uvicorn serves the ASGI application instead of uwsgi, login and
+# phone verification then run as async views (see core.urls), one worker
+# keeps thousands of them waiting on redis. Other views still run in a
+# thread of their worker, so keep ASGI_WORKERS near the number of cores.
+# uvicorn speaks HTTP on port 8000, not the uwsgi protocol of uwsgi.ini.
+if [ "$SERVER" = "uvicorn" ]; then
+    exec uvicorn {{cookiecutter.project_name}}.asgi:application \
+        --host 0.0.0.0 --port 8000 \
+        --workers "${ASGI_WORKERS:-2}" \
+        --no-access-log
+fi
+
 uwsgi --ini /app/uwsgi.ini
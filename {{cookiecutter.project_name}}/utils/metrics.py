@@ -0,0 +1,178 @@
+import atexit
+import contextvars
+import threading
+import time
+from collections import defaultdict
+
+import redis
+from django.conf import settings
+
+# seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+HASH_KEY = "metrics"
+
+_timings = contextvars.ContextVar("request_timings", default=None)
+
+_buffer = defaultdict(float)  # "name\tlabels\tfield" -> increment
+_buffer_lock = threading.Lock()
+_next_flush = 0.0
+
+
+class RequestTimings:
+    """Time spent by the current request, filled by the record_* hooks"""
+
+    __slots__ = (
+        "db_count",
+        "db_time",
+        "redis_count",
+        "redis_time",
+        "render_time",
+    )
+
+    def __init__(self):
+        self.db_count = 0
+        self.db_time = 0.0
+        self.redis_count = 0
+        self.redis_time = 0.0
+        self.render_time = 0.0
+
+
+def start_request():
+    """Collect the timings of the current context until end_request(token)
+
+    Returns:
+        tuple: (RequestTimings, token)
+    """
+    timings = RequestTimings()
+    return timings, _timings.set(timings)
+
+
+def end_request(token):
+    _timings.reset(token)
+
+
+def record_db(duration):
+    timings = _timings.get()
+    if timings is not None:
+        timings.db_count += 1
+        timings.db_time += duration
+
+
+def record_redis(duration, commands=0):
+    timings = _timings.get()
+    if timings is not None:
+        timings.redis_count += commands
+        timings.redis_time += duration
+
+
+def record_render(duration):
+    timings = _timings.get()
+    if timings is not None:
+        timings.render_time += duration
+
+
+def _labels(labels):
+    return ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels.items()
+    )
+
+
+def observe(name, labels, value):
+    """Add a value to a histogram, buffered until the next flush()"""
+    series = f"{name}\t{_labels(labels)}\t"
+    with _buffer_lock:
+        for le in BUCKETS:
+            if value <= le:
+                _buffer[f"{series}{le}"] += 1
+                break
+        _buffer[f"{series}sum"] += value
+        _buffer[f"{series}count"] += 1
+
+
+def increment(name, labels, value=1):
+    """Add to a counter, buffered until the next flush()"""
+    with _buffer_lock:
+        _buffer[f"{name}\t{_labels(labels)}\ttotal"] += value
+
+
+def _client():
+    from utils.redis_func import get_pool  # utils.redis_func reports to this module
+
+    return redis.StrictRedis(connection_pool=get_pool(db=1))
+
+
+def flush():
+    """Add the buffered metrics of this process to the shared redis hash"""
+    global _next_flush
+    with _buffer_lock:
+        data = dict(_buffer)
+        _buffer.clear()
+        _next_flush = time.monotonic() + settings.METRICS_FLUSH_INTERVAL
+    if not data:
+        return
+    with _client().pipeline(transaction=False) as pipe:
+        for field, value in data.items():
+            if field.endswith("\tsum"):
+                pipe.hincrbyfloat(HASH_KEY, field, value)
+            else:
+                pipe.hincrby(HASH_KEY, field, int(value))
+        pipe.execute()
+
+
+def flush_due():
+    return time.monotonic() >= _next_flush
+
+
+def maybe_flush():
+    """flush() once every METRICS_FLUSH_INTERVAL seconds"""
+    if flush_due():
+        flush()
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        pass
+
+
+atexit.register(_flush_at_exit)
+
+
+def _sample(name, labels, value, le=None):
+    if le is not None:
+        labels = ",".join(filter(None, [labels, f'le="{le}"']))
+    value = f"{value:.6f}".rstrip("0").rstrip(".")
+    return name + "{" + labels + "} " + value
+
+
+def render_prometheus():
+    """Metrics of every worker in the Prometheus text format
+
+    Histogram buckets are stored per bucket and made cumulative here.
+    """
+    series = defaultdict(dict)  # (name, labels) -> field -> value
+    for field, value in _client().hgetall(HASH_KEY).items():
+        name, labels, kind = field.split("\t")
+        series[(name, labels)][kind] = float(value)
+
+    lines = []
+    typed = set()
+    for (name, labels), fields in sorted(series.items()):
+        kind = "counter" if "total" in fields else "histogram"
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+        if kind == "counter":
+            lines.append(_sample(f"{name}_total", labels, fields["total"]))
+            continue
+        cumulative = 0
+        for le in BUCKETS:
+            cumulative += fields.get(str(le), 0)
+            lines.append(_sample(f"{name}_bucket", labels, cumulative, le))
+        count = fields.get("count", 0)
+        lines.append(_sample(f"{name}_bucket", labels, count, "+Inf"))
+        lines.append(_sample(f"{name}_sum", labels, fields.get("sum", 0)))
+        lines.append(_sample(f"{name}_count", labels, count))
+    return "\n".join(lines) + "\n"
@@ -1,6 +1,188 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+import weakref
+
 import redis
+import redis.asyncio as aioredis
 from django.conf import settings
 
+from utils import metrics
+
+
+class InstrumentedConnection(redis.Connection):
+    """Connection that adds its round trips to utils.metrics of the current request"""
+
+    def send_packed_command(self, command, check_health=True):
+        start = time.perf_counter()
+        try:
+            return super().send_packed_command(command, check_health)
+        finally:
+            metrics.record_redis(time.perf_counter() - start, 1)
+
+    def read_response(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().read_response(*args, **kwargs)
+        finally:
+            metrics.record_redis(time.perf_counter() - start)
+
+
+class InstrumentedAsyncConnection(aioredis.Connection):
+    """InstrumentedConnection for redis.asyncio"""
+
+    async def send_packed_command(self, command, check_health=True):
+        start = time.perf_counter()
+        try:
+            return await super().send_packed_command(command, check_health)
+        finally:
+            metrics.record_redis(time.perf_counter() - start, 1)
+
+    async def read_response(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().read_response(*args, **kwargs)
+        finally:
+            metrics.record_redis(time.perf_counter() - start)
+
+
+class InstrumentedConnectionPool(redis.BlockingConnectionPool):
+    """Bounded connection pool that keeps checkout wait-time stats,
+    so `max_connections` can be sized against the number of workers
+    """
+
+    def __init__(self, connection_class=InstrumentedConnection, **kwargs):
+        super().__init__(connection_class=connection_class, **kwargs)
+
+    def reset(self):
+        super().reset()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def get_connection(self, command_name, *keys, **options):
+        start = time.perf_counter()
+        try:
+            return super().get_connection(command_name, *keys, **options)
+        except redis.ConnectionError:
+            self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+
+def reset_pools():
+    """Forget every pool of the parent process, called in the child after fork"""
+    global _pools_pid
+    with _pools_lock:
+        _pools.clear()
+        _pools_pid = os.getpid()
+
+
+def get_pool(
+    host=settings.REDIS_HOST,
+    port=settings.REDIS_PORT,
+    password=settings.REDIS_PSWD,
+    db=0,
+    decode_responses=True,
+):
+    """Get the process-wide connection pool of (host, port, db)
+
+    Pools are created lazily once per worker.
+
+    Args:
+        host (str): redis host
+        port (int): redis port
+        password (str): redis password
+        db (int): redis db
+        decode_responses (bool): decode responses to str
+
+    Returns:
+        redis.ConnectionPool: shared connection pool
+    """
+    if _pools_pid != os.getpid():
+        reset_pools()
+
+    key = (host, int(port), db, decode_responses)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = InstrumentedConnectionPool(
+                    host=host,
+                    port=int(port),
+                    password=password,
+                    db=db,
+                    decode_responses=decode_responses,
+                    max_connections=settings.REDIS_MAX_CONNECTIONS,
+                    timeout=settings.REDIS_POOL_TIMEOUT,
+                )
+    return pool
+
+
+def _pool_usage(pool):
+    if isinstance(pool, redis.BlockingConnectionPool):
+        created = len(pool._connections)
+        idle = sum(1 for connection in list(pool.pool.queue) if connection)
+    else:
+        created = pool._created_connections
+        idle = len(pool._available_connections)
+    usage = {
+        "max_connections": pool.max_connections,
+        "created": created,
+        "in_use": created - idle,
+        "idle": idle,
+    }
+    if isinstance(pool, InstrumentedConnectionPool):
+        usage.update(
+            checkouts=pool.checkouts,
+            timeouts=pool.timeouts,
+            wait_total=pool.wait_total,
+            wait_max=pool.wait_max,
+        )
+    return usage
+
+
+def pool_stats():
+    """Utilisation and wait-time stats of every pool in this process
+
+    Returns:
+        list: one dict per (host, port, db, decode_responses) pool
+    """
+    stats = []
+    for (host, port, db, decode_responses), pool in list(_pools.items()):
+        stats.append(
+            {
+                "pid": os.getpid(),
+                "host": host,
+                "port": port,
+                "db": db,
+                "decode_responses": decode_responses,
+                **_pool_usage(pool),
+            }
+        )
+    return stats
+
+
+try:
+    from uwsgidecorators import postfork
+except ImportError:
+    pass
+else:
+    postfork(reset_pools)
+
 
 class Client:
     def __init__(
@@ -10,13 +192,7 @@ class Client:
         password=settings.REDIS_PSWD,
         db=1,
     ):
-        pools = redis.ConnectionPool(
-            host=host,
-            port=port,
-            password=password,
-            db=db,
-            decode_responses=True,
-        )
+        pools = get_pool(host, port, password, db)
         self.__redis = redis.StrictRedis(connection_pool=pools)
 
     def set(self, key, value):
@@ -37,6 +213,133 @@ class Client:
     def delete(self, key):
         return self.__redis.delete(key)
 
+    def pipeline(self, transaction=True):
+        return self.__redis.pipeline(transaction=transaction)
+
+    def register_script(self, script):
+        return self.__redis.register_script(script)
+
+
+# asyncio connections are bound to the event loop that opened them
+_async_pools = weakref.WeakKeyDictionary()
+
+
+def get_async_pool(
+    host=settings.REDIS_HOST,
+    port=settings.REDIS_PORT,
+    password=settings.REDIS_PSWD,
+    db=0,
+    decode_responses=True,
+):
+    """Get the redis.asyncio connection pool of (host, port, db) for the running loop
+
+    Must be called from a coroutine, the pool is dropped with its loop.
+
+    Returns:
+        redis.asyncio.ConnectionPool: shared connection pool
+    """
+    pools = _async_pools.setdefault(asyncio.get_running_loop(), {})
+    key = (host, int(port), db, decode_responses)
+    pool = pools.get(key)
+    if pool is None:
+        pool = pools[key] = aioredis.BlockingConnectionPool(
+            connection_class=InstrumentedAsyncConnection,
+            host=host,
+            port=int(port),
+            password=password,
+            db=db,
+            decode_responses=decode_responses,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            timeout=settings.REDIS_POOL_TIMEOUT,
+        )
+    return pool
+
+
+class AsyncClient:
+    """Client for coroutines, every method is awaited"""
+
+    def __init__(
+        self,
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        password=settings.REDIS_PSWD,
+        db=1,
+    ):
+        pools = get_async_pool(host, port, password, db)
+        self.__redis = aioredis.StrictRedis(connection_pool=pools)
+
+    async def set(self, key, value):
+        return await self.__redis.set(key, value, ex=settings.VERIFICATION_CODE_EXPIRES)
+
+    async def get(self, key):
+        return await self.__redis.get(key)
+
+    async def get_expired(self, key):
+        ttl = await self.__redis.ttl(key)
+        return None if ttl == -2 else ttl
+
+    async def delete(self, key):
+        return await self.__redis.delete(key)
+
+    def pipeline(self, transaction=True):
+        return self.__redis.pipeline(transaction=transaction)
+
+    def register_script(self, script):
+        return self.__redis.register_script(script)
+
+
+# KEYS: ready list, processing list; ARGV: value, value pushed back (optional)
+NACK_SCRIPT = """
+if redis.call("LREM", KEYS[2], 1, ARGV[1]) == 0 then
+    return 0
+end
+redis.call("RPUSH", KEYS[1], ARGV[2] or ARGV[1])
+return 1
+"""
+
+# KEYS: ready list, processing list; ARGV: max count
+RESERVE_MANY_SCRIPT = """
+local items = {}
+for _ = 1, tonumber(ARGV[1]) do
+    local value = redis.call("LMOVE", KEYS[1], KEYS[2], "LEFT", "LEFT")
+    if not value then
+        break
+    end
+    items[#items + 1] = value
+end
+return items
+"""
+
+# KEYS: ready list, consumers set, processing list, heartbeat of one consumer
+# ARGV: consumer, "1" to release it even if its heartbeat is alive
+REAP_SCRIPT = """
+if ARGV[2] ~= "1" and redis.call("EXISTS", KEYS[4]) == 1 then
+    return 0
+end
+local moved = 0
+while redis.call("LMOVE", KEYS[3], KEYS[1], "LEFT", "LEFT") do
+    moved = moved + 1
+end
+redis.call("SREM", KEYS[2], ARGV[1])
+redis.call("DEL", KEYS[4])
+return moved
+"""
+
+# KEYS: ready list, delayed sorted set; ARGV: now, max count
+PROMOTE_SCRIPT = """
+local due = redis.call("ZRANGEBYSCORE", KEYS[2], "-inf", ARGV[1], "LIMIT", 0, ARGV[2])
+if #due == 0 then
+    return 0
+end
+local values = {}
+for i, member in ipairs(due) do
+    values[i] = string.sub(member, 34)
+end
+redis.call("RPUSH", KEYS[1], unpack(values))
+redis.call("ZREM", KEYS[2], unpack(due))
+return #due
+"""
+
 
 class Queue:
     def __init__(
@@ -48,27 +351,36 @@ class Queue:
         password=settings.REDIS_PSWD,
         db=2,
     ):
-        pools = redis.ConnectionPool(
-            host=host,
-            port=port,
-            password=password,
-            db=db,
-            decode_responses=True,
-        )
+        pools = get_pool(host, port, password, db)
         self.__redis = redis.StrictRedis(connection_pool=pools)
         self.__key = f"{namespace}:{name}"
+        self.__consumers = f"{self.__key}:consumers"
+        self.__delayed = f"{self.__key}:delayed"
 
     def insert(self, value):
         return self.__redis.lpush(self.__key, value)
 
+    def insert_many(self, values):
+        if not values:
+            return 0
+        return self.__redis.lpush(self.__key, *values)
+
     def append(self, value):
         return self.__redis.rpush(self.__key, value)
 
+    def append_many(self, values):
+        if not values:
+            return 0
+        return self.__redis.rpush(self.__key, *values)
+
     def get(self):
         return self.__redis.lpop(self.__key)
 
+    def pop_many(self, count):
+        return self.__redis.lpop(self.__key, count) or []
+
     def get_wait(self, timeout=None):
-        return self.__redis.blpop(self.key, timeout=timeout)
+        return self.__redis.blpop(self.__key, timeout=timeout)
 
     def size(self):
         return self.__redis.llen(self.__key)
@@ -78,3 +390,118 @@ class Queue:
 
     def get_all(self):
         return self.__redis.lrange(self.__key, 0, -1)
+
+    # Reliable mode: reserved items stay in a per-consumer processing list
+    # until they are acked, the consumer keeps a heartbeat key alive and
+    # reap() pushes back the items of consumers whose heartbeat expired.
+
+    def _processing(self, consumer):
+        return f"{self.__key}:processing:{consumer}"
+
+    def _heartbeat(self, consumer):
+        return f"{self.__key}:heartbeat:{consumer}"
+
+    def heartbeat(self, consumer, visibility_timeout=60):
+        """Register consumer and keep its reserved items invisible for visibility_timeout seconds"""
+        with self.__redis.pipeline() as pipe:
+            pipe.sadd(self.__consumers, consumer)
+            pipe.set(self._heartbeat(consumer), 1, ex=visibility_timeout)
+            pipe.execute()
+
+    def consumers(self):
+        """Consumers registered by heartbeat() and not reaped yet"""
+        return self.__redis.smembers(self.__consumers)
+
+    def reserve(self, consumer, timeout=None):
+        """Move the head item into the processing list of consumer, waiting up to timeout seconds"""
+        return self.__redis.blmove(
+            self.__key, self._processing(consumer), timeout or 0, "LEFT", "LEFT"
+        )
+
+    def reserve_many(self, consumer, count):
+        """Move up to count items into the processing list of consumer in one round trip"""
+        script = self.__redis.register_script(RESERVE_MANY_SCRIPT)
+        return script(keys=[self.__key, self._processing(consumer)], args=[count])
+
+    def ack(self, consumer, value):
+        return self.__redis.lrem(self._processing(consumer), 1, value)
+
+    def nack(self, consumer, value, requeue_value=None):
+        """Push a reserved item (or requeue_value in its place) back to the tail of the queue"""
+        script = self.__redis.register_script(NACK_SCRIPT)
+        args = [value] if requeue_value is None else [value, requeue_value]
+        return script(keys=[self.__key, self._processing(consumer)], args=args)
+
+    def reap(self, consumer=""):
+        """Requeue the items of consumers whose heartbeat expired, or of the given consumer
+
+        Returns:
+            int: number of requeued items
+        """
+        consumers = [consumer] if consumer else self.__redis.smembers(self.__consumers)
+        if not consumers:
+            return 0
+        script = self.__redis.register_script(REAP_SCRIPT)
+        # one script per consumer, every key it touches is passed in KEYS
+        with self.__redis.pipeline(transaction=False) as pipe:
+            for name in consumers:
+                script(
+                    keys=[
+                        self.__key,
+                        self.__consumers,
+                        self._processing(name),
+                        self._heartbeat(name),
+                    ],
+                    args=[name, "1" if consumer else ""],
+                    client=pipe,
+                )
+            return sum(pipe.execute())
+
+    # Delayed jobs wait in a sorted set scored by their due time,
+    # promote() moves due items to the tail of the queue in batches.
+
+    def schedule(self, value, delay=0, eta=None):
+        """Append value to the queue after delay seconds, or at eta (datetime)"""
+        due = eta.timestamp() if eta else time.time() + delay
+        # uuid prefix (32 chars + ":") keeps duplicated values apart
+        return self.__redis.zadd(self.__delayed, {f"{uuid.uuid4().hex}:{value}": due})
+
+    def promote(self, batch=500):
+        """Move up to batch due items into the queue with one atomic script
+
+        Returns:
+            int: number of promoted items
+        """
+        script = self.__redis.register_script(PROMOTE_SCRIPT)
+        return script(keys=[self.__key, self.__delayed], args=[time.time(), batch])
+
+    def delayed_size(self):
+        return self.__redis.zcard(self.__delayed)
+
+
+class AsyncQueue:
+    """Producer side of Queue for coroutines, consumed by the same workers"""
+
+    def __init__(
+        self,
+        name,
+        namespace="queue",
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        password=settings.REDIS_PSWD,
+        db=2,
+    ):
+        pools = get_async_pool(host, port, password, db)
+        self.__redis = aioredis.StrictRedis(connection_pool=pools)
+        self.__key = f"{namespace}:{name}"
+
+    async def append(self, value):
+        return await self.__redis.rpush(self.__key, value)
+
+    async def append_many(self, values):
+        if not values:
+            return 0
+        return await self.__redis.rpush(self.__key, *values)
+
+    async def size(self):
+        return await self.__redis.llen(self.__key)
@@ -0,0 +1,135 @@
+import contextvars
+import random
+import threading
+import time
+
+# keep rate and record rate of the transaction started in this context
+_decision = contextvars.ContextVar("trace_decision", default=None)
+
+
+def parse_rates(value):
+    """Parse "POST:/login/=1,GET:/users/=0.01,/metrics=0" into [(method, prefix, rate)],
+    a rule without method matches every method
+    """
+    rules = []
+    for rule in filter(None, (part.strip() for part in value.split(","))):
+        route, rate = rule.rsplit("=", 1)
+        method, prefix = (None, route) if route.startswith("/") else route.split(":", 1)
+        rules.append((method and method.upper(), prefix, float(rate)))
+    # longest prefix wins
+    return sorted(rules, key=lambda rule: (len(rule[1]), rule[0] is not None))[::-1]
+
+
+class TraceSampler:
+    """Per-route, budgeted and tail-based sampling of Sentry transactions
+
+    traces_sampler() records a transaction with its route's rate, at least
+    record_rate. When it finishes, process_event() always keeps it if it
+    failed with a 5xx or took `slow` seconds or more. Otherwise it is kept
+    so that the route's rate is met. Every `window` seconds the rates and
+    the record rate are scaled so that about `per_second` transactions are
+    kept per second in this process, so the tracing overhead follows the
+    budget too. Routes with a rate of 1 are always traced, they are never
+    scaled and left out of the budget.
+
+    Args:
+        rates (list): (method, path prefix, rate) rules, see parse_rates()
+        default_rate (float): rate of paths without a rule
+        record_rate (float): rate at which transactions are recorded for tail
+            sampling, only slow or failed transactions among the recorded
+            ones are always kept, 1 traces every request in process
+        slow (float): seconds after which a transaction is always kept
+        per_second (float): kept transactions per second, 0 disables scaling
+        window (float): seconds between two adjustments of the scale
+    """
+
+    MIN_SCALE = 0.001
+    MAX_SCALE = 100
+
+    def __init__(
+        self,
+        rates=(),
+        default_rate=0.05,
+        record_rate=0.2,
+        slow=1.0,
+        per_second=0,
+        window=10,
+    ):
+        self.rates = list(rates)
+        self.default_rate = default_rate
+        self.record_rate = record_rate
+        self.slow = slow
+        self.per_second = per_second
+        self.window = window
+        self.scale = 1.0
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._kept = 0
+
+    def route_rate(self, method, path):
+        for rule_method, prefix, rate in self.rates:
+            if path.startswith(prefix) and rule_method in (None, method):
+                return rate
+        return self.default_rate
+
+    def traces_sampler(self, sampling_context):
+        """traces_sampler of sentry_sdk.init()"""
+        parent_sampled = sampling_context.get("parent_sampled")
+        if parent_sampled is not None:
+            _decision.set(None)
+            return float(parent_sampled)
+
+        environ = sampling_context.get("wsgi_environ")
+        scope = sampling_context.get("asgi_scope")
+        if environ is not None:
+            method, path = environ.get("REQUEST_METHOD"), environ.get("PATH_INFO", "")
+        elif scope is not None:
+            method, path = scope.get("method"), scope.get("path", "")
+        else:
+            method, path = None, ""
+
+        rate = self.route_rate(method, path)
+        if rate <= 0 or rate >= 1:
+            _decision.set(None)
+            return min(rate, 1.0)
+        rate = min(1.0, rate * self.scale)
+        recorded = min(1.0, max(rate, self.record_rate * self.scale))
+        _decision.set((rate, recorded))
+        return recorded
+
+    def process_event(self, event, hint):
+        """Global event processor, drops the recorded transactions not kept"""
+        if event.get("type") != "transaction":
+            return event
+        decision = _decision.get()
+        if decision is None:
+            return event
+        rate, recorded = decision
+        if not self._must_keep(event) and random.random() >= rate / recorded:
+            return None
+        self._adjust()
+        return event
+
+    def _must_keep(self, event):
+        status = event.get("tags", {}).get("http.status_code")
+        if status and status.isdigit() and int(status) >= 500:
+            return True
+        try:
+            duration = (event["timestamp"] - event["start_timestamp"]).total_seconds()
+        except (KeyError, TypeError):
+            return False
+        return duration >= self.slow
+
+    def _adjust(self):
+        with self._lock:
+            self._kept += 1
+            now = time.monotonic()
+            elapsed = now - self._window_start
+            if elapsed < self.window:
+                return
+            if self.per_second:
+                target = self.per_second * elapsed
+                scale = self.scale * target / self._kept
+                self.scale = min(self.MAX_SCALE, max(self.MIN_SCALE, scale))
+            self._window_start = now
+            self._kept = 0
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class BaseSMSProvider:
+    """Send templated SMS, set SMS_PROVIDER to a subclass to plug in another provider"""
+
+    # max phone numbers of one provider request
+    batch_size = 1
+
+    def send_batch(self, phone_numbers, type, params):
+        """Send one template to many phone numbers
+
+        Args:
+            phone_numbers (list): phone numbers
+            type (str): sms template type [register, update, reset]
+            params (list): template params
+
+        Returns:
+            dict: phone number -> {"ok": bool, "code": str, "message": str}
+
+        By default send() is called for every number, a subclass overrides
+        send() or send_batch()
+        """
+        if self.__class__.send is BaseSMSProvider.send:
+            raise NotImplementedError("override send() or send_batch()")
+        return {phone: self.send(phone, type, params) for phone in phone_numbers}
+
+    def send(self, phone_number, type, params):
+        return self.send_batch([phone_number], type, params)[phone_number]
+
+    async def asend_batch(self, phone_numbers, type, params):
+        """send_batch() for coroutines, override it with a native async client,
+        by default the blocking send_batch() runs in a thread
+        """
+        return await asyncio.to_thread(self.send_batch, phone_numbers, type, params)
+
+    async def asend(self, phone_number, type, params):
+        return (await self.asend_batch([phone_number], type, params))[phone_number]
+
+
+class TencentSMSProvider(BaseSMSProvider):
+    batch_size = 200
+
+    def __init__(self):
+        from tencentcloud.common import credential
+        from tencentcloud.common.profile.client_profile import ClientProfile
+        from tencentcloud.common.profile.http_profile import HttpProfile
+        from tencentcloud.sms.v20190711 import models, sms_client
+
+        cred = credential.Credential(settings.SMS_SECRET_ID, settings.SMS_SECRET_KEY)
+        httpProfile = HttpProfile()
+        httpProfile.reqMethod = "POST"
+        httpProfile.reqTimeout = 30
+        httpProfile.keepAlive = True
+        httpProfile.endpoint = settings.SMS_ENDPOINT
+        clientProfile = ClientProfile()
+        clientProfile.signMethod = "TC3-HMAC-SHA256"
+        clientProfile.language = "en-US"
+        clientProfile.httpProfile = httpProfile
+        self.client = sms_client.SmsClient(cred, "ap-guangzhou", clientProfile)
+        self.models = models
+
+    def send_batch(self, phone_numbers, type, params):
+        results = {}
+        for i in range(0, len(phone_numbers), self.batch_size):
+            numbers = {
+                "+86" + phone: phone for phone in phone_numbers[i : i + self.batch_size]
+            }
+            req = self.models.SendSmsRequest()
+            req.SmsSdkAppid = settings.SMS_SDK_APPID
+            req.Sign = settings.SMS_SIGN
+            req.ExtendCode = ""
+            req.SessionContext = ""
+            req.SenderId = ""
+            req.PhoneNumberSet = list(numbers)
+            req.TemplateID = settings.SMS_TEMPLATES[type]
+            req.TemplateParamSet = list(params)
+            resp = self.client.SendSms(req)
+            for status in resp.SendStatusSet:
+                results[numbers.get(status.PhoneNumber, status.PhoneNumber)] = {
+                    "ok": status.Code == "Ok",
+                    "code": status.Code,
+                    "message": status.Message,
+                }
+        return results
+
+
+class LocalSMSProvider(BaseSMSProvider):
+    """Keep the last `outbox_size` messages in `outbox` instead of sending them,
+    for development and tests
+    """
+
+    batch_size = 200
+    outbox_size = 100
+
+    def __init__(self):
+        self.outbox = deque(maxlen=self.outbox_size)
+
+    async def asend_batch(self, phone_numbers, type, params):
+        return self.send_batch(phone_numbers, type, params)
+
+    def send_batch(self, phone_numbers, type, params):
+        results = {}
+        for phone in phone_numbers:
+            self.outbox.append({"phone": phone, "type": type, "params": list(params)})
+            logger.info("SMS %s to %s: %s", type, phone, params)
+            results[phone] = {"ok": True, "code": "Ok", "message": "send success"}
+        return results
+
+
+_local = threading.local()
+
+
+def get_sms_provider():
+    """Get the SMS_PROVIDER instance of this thread, it is created once and reused
+    so that its http connection is kept alive between messages
+    """
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.provider = import_string(settings.SMS_PROVIDER)()
+        _local.pid = os.getpid()
+    return _local.provider
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+from unittest import TestCase, mock
+
+from utils.sentry import TraceSampler, parse_rates
+
+
+def environ(method, path):
+    return {"wsgi_environ": {"REQUEST_METHOD": method, "PATH_INFO": path}}
+
+
+def transaction(status="200", duration=0.01):
+    start = datetime(2023, 1, 1)
+    return {
+        "type": "transaction",
+        "tags": {"http.status_code": status},
+        "start_timestamp": start,
+        "timestamp": start + timedelta(seconds=duration),
+    }
+
+
+class ParseRatesTests(TestCase):
+    def test_precedence(self):
+        sampler = TraceSampler(
+            parse_rates(
+                "GET:/users/=0.01, /users/=0.5, /users/batch/=0.2,"
+                "POST:/login/=1,/metrics=0"
+            ),
+            default_rate=0.05,
+        )
+        # the longest prefix wins, then the rule with a method
+        self.assertEqual(sampler.route_rate("GET", "/users/batch/"), 0.2)
+        self.assertEqual(sampler.route_rate("GET", "/users/1/"), 0.01)
+        self.assertEqual(sampler.route_rate("PATCH", "/users/1/"), 0.5)
+        self.assertEqual(sampler.route_rate("POST", "/login/"), 1)
+        self.assertEqual(sampler.route_rate("GET", "/login/"), 0.05)
+        self.assertEqual(sampler.route_rate("GET", "/metrics"), 0)
+
+    def test_method_is_case_insensitive(self):
+        self.assertEqual(parse_rates("post:/login/=1"), [("POST", "/login/", 1.0)])
+
+
+class TraceSamplerTests(TestCase):
+    def test_must_keep(self):
+        sampler = TraceSampler(slow=1)
+        self.assertTrue(sampler._must_keep(transaction(status="502")))
+        self.assertTrue(sampler._must_keep(transaction(duration=1.5)))
+        self.assertFalse(sampler._must_keep(transaction(status="404")))
+        self.assertFalse(sampler._must_keep({"type": "transaction", "tags": {}}))
+
+    def test_tail_keeps_slow_and_failed(self):
+        sampler = TraceSampler(default_rate=0.01, record_rate=1)
+        for event in (transaction(status="500"), transaction(duration=2)):
+            self.assertEqual(sampler.traces_sampler(environ("GET", "/users/")), 1)
+            self.assertIs(sampler.process_event(event, None), event)
+
+    def test_zero_and_full_rates(self):
+        sampler = TraceSampler(parse_rates("POST:/login/=1,/metrics=0"))
+        self.assertEqual(sampler.traces_sampler(environ("GET", "/metrics")), 0)
+        sampler.scale = sampler.MIN_SCALE
+        self.assertEqual(sampler.traces_sampler(environ("POST", "/login/")), 1)
+        self.assertEqual(sampler.traces_sampler({"parent_sampled": True}), 1)
+
+    @mock.patch("utils.sentry.random.random", return_value=0)
+    @mock.patch("utils.sentry.time.monotonic")
+    def test_budget_scales_rate_and_record_rate(self, monotonic, random):
+        monotonic.return_value = 0
+        sampler = TraceSampler(
+            parse_rates("POST:/login/=1"),
+            default_rate=0.5,
+            record_rate=0.8,
+            per_second=10,
+            window=10,
+        )
+        # 1000 kept in 10 seconds, 10 times over the budget
+        for _ in range(999):
+            sampler.traces_sampler(environ("GET", "/users/"))
+            sampler.process_event(transaction(), None)
+        monotonic.return_value = 10
+        sampler.traces_sampler(environ("GET", "/users/"))
+        sampler.process_event(transaction(), None)
+        self.assertAlmostEqual(sampler.scale, 0.1)
+        self.assertAlmostEqual(sampler.traces_sampler(environ("GET", "/users/")), 0.08)
+        self.assertEqual(sampler.traces_sampler(environ("POST", "/login/")), 1)
+
+        # rate 1 routes are left out of the budget
+        for _ in range(1000):
+            sampler.traces_sampler(environ("POST", "/login/"))
+            sampler.process_event(transaction(), None)
+        monotonic.return_value = 20
+        sampler.traces_sampler(environ("GET", "/users/"))
+        sampler.process_event(transaction(), None)
+        self.assertAlmostEqual(sampler.scale, 10)
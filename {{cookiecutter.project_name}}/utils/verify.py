@@ -1,26 +1,33 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import hashlib
+import hmac
 import json
+import logging
+import re
+import smtplib
+import time
 
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection
 from django.conf import settings
 
-from utils.redis_func import Client as RedisClient
+from utils.redis_func import (
+    AsyncClient as AsyncRedisClient,
+    AsyncQueue,
+    Client as RedisClient,
+    Queue,
+)
+from utils.sms import get_sms_provider
 
+logger = logging.getLogger(__name__)
 
-# Custom SMS Provider
-from tencentcloud.common import credential
-from tencentcloud.common.exception.tencent_cloud_sdk_exception import (
-    TencentCloudSDKException,
-)
-from tencentcloud.common.profile.client_profile import ClientProfile
-from tencentcloud.common.profile.http_profile import HttpProfile
-from tencentcloud.sms.v20190711 import models, sms_client
+# mainland China mobile numbers
+PHONE_PATTERN = re.compile(r"^1[3-9]\d{9}$")
 
 
 def send_sms(phone_number, code, type):
-    """Since Django does not currently have a good SMS sending plugin,
-    if you need to use the SMS authentication function,
-    you need to use the SMS provider's SDK to rewrite the send_sms function to achieve related functions
+    """Send verify code by the SMS_PROVIDER (utils.sms.TencentSMSProvider by default),
+    subclass utils.sms.BaseSMSProvider to use another SMS provider
 
     Args:
         phone_number (str): phone number
@@ -28,47 +35,136 @@ def send_sms(phone_number, code, type):
         type (str): sms template type [register, update, reset]
 
     Returns:
-        bool: True if send success, False if send failed
+        dict: {"ok": bool, "code": str, "message": str}
+    """
+    return get_sms_provider().send(phone_number, type, [code])
+
+
+def send_sms_batch(phone_numbers, params, type):
+    """Send one sms template to many phone numbers,
+    packed into as few provider requests as its batch size allows
+
+    Args:
+        phone_numbers (list): phone numbers
+        params (list): template params
+        type (str): sms template type [register, update, reset]
+
+    Returns:
+        dict: phone number -> {"ok": bool, "code": str, "message": str}
     """
+    return get_sms_provider().send_batch(list(phone_numbers), type, params)
+
+
+async def asend_sms(phone_number, code, type):
+    """send_sms() for coroutines, see BaseSMSProvider.asend_batch"""
+    return await get_sms_provider().asend(phone_number, type, [code])
+
+
+async def asend_sms_batch(phone_numbers, params, type):
+    return await get_sms_provider().asend_batch(list(phone_numbers), type, params)
+
+
+class DeliveryError(Exception):
+    pass
 
-    cred = credential.Credential(settings.SMS_SECRET_ID, settings.SMS_SECRET_KEY)
-    httpProfile = HttpProfile()
-    httpProfile.reqMethod = "POST"
-    httpProfile.reqTimeout = 30
-    httpProfile.endpoint = settings.SMS_ENDPOINT
-    clientProfile = ClientProfile()
-    clientProfile.signMethod = "TC3-HMAC-SHA256"
-    clientProfile.language = "en-US"
-    clientProfile.httpProfile = httpProfile
-    client = sms_client.SmsClient(cred, "ap-guangzhou", clientProfile)
-    req = models.SendSmsRequest()
-    req.SmsSdkAppid = settings.SMS_SDK_APPID
-    req.Sign = settings.SMS_SIGN
-    req.ExtendCode = ""
-    req.SessionContext = ""
-    req.SenderId = ""
-    req.PhoneNumberSet = ["+86" + phone_number]
-    req.TemplateID = settings.SMS_TEMPLATES[type]
-    req.TemplateParamSet = [code]
-    resp = client.SendSms(req)
-    ret = json.loads(resp.to_json_string(indent=2))
-    return ret
+
+EMAIL_TYPES = {
+    "register": "{{cookiecutter.project_name_cn}}注册",
+    "update": "{{cookiecutter.project_name_cn}}邮箱绑定",
+    "reset": "{{cookiecutter.project_name_cn}}密码重置",
+}
 
 
 def send_email(email, code, type):
-    TYPES = {
-        "register": "{{cookiecutter.project_name_cn}}注册",
-        "update": "{{cookiecutter.project_name_cn}}邮箱绑定",
-        "reset": "{{cookiecutter.project_name_cn}}密码重置",
-    }
-    title = TYPES[type]
-    content = f"您的验证码为{code}。有效期为10分钟，请尽快输入！"
-    ret = send_mail(title, content, settings.EMAIL_FROM, [email], fail_silently=True)
-    return ret
+    failures = send_email_batch([(email, code, type)])
+    return 0 if failures else 1
+
+
+async def asend_email(email, code, type):
+    """send_email() for coroutines, smtplib blocks so it runs in a thread"""
+    return await asyncio.to_thread(send_email, email, code, type)
+
+
+def send_email_batch(messages):
+    """Send many verify code emails over one SMTP connection,
+    a failed message does not stop the others
+
+    Args:
+        messages (iterable): (email, code, type) tuples, type in EMAIL_TYPES
+
+    Returns:
+        dict: index in messages -> exception, for every message that was not sent
+    """
+    messages = list(messages)
+    failures = {}
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as exc:
+        return dict.fromkeys(range(len(messages)), exc)
+
+    try:
+        for index, (email, code, type) in enumerate(messages):
+            message = EmailMessage(
+                EMAIL_TYPES[type],
+                f"您的验证码为{code}。有效期为10分钟，请尽快输入！",
+                settings.EMAIL_FROM,
+                [email],
+                connection=connection,
+            )
+            try:
+                message.send()
+            except smtplib.SMTPServerDisconnected as exc:
+                failures[index] = exc
+                # reconnect once, the next messages share the new connection
+                connection.close()
+                try:
+                    connection.open()
+                except Exception:
+                    pass
+            except Exception as exc:
+                failures[index] = exc
+    finally:
+        connection.close()
+    return failures
+
+
+CODE_MISSING = 0
+CODE_OK = 1
+CODE_WRONG = 2
+CODE_LOCKED = 3
+
+# KEYS: code hash, lock key
+# ARGV: hashed code, max attempts, lockout seconds
+CHECK_CODE_SCRIPT = """
+if redis.call("EXISTS", KEYS[2]) == 1 then
+    return 3
+end
+local stored = redis.call("HGET", KEYS[1], "code")
+if not stored then
+    return 0
+end
+if stored == ARGV[1] then
+    redis.call("DEL", KEYS[1])
+    return 1
+end
+if redis.call("HINCRBY", KEYS[1], "attempts", 1) >= tonumber(ARGV[2]) then
+    redis.call("DEL", KEYS[1])
+    redis.call("SET", KEYS[2], 1, "EX", ARGV[3])
+    return 3
+end
+return 2
+"""
+
+
+def _hash_code(key, code):
+    return hmac.new(
+        settings.SECRET_KEY.encode(), f"{key}:{code}".encode(), hashlib.sha256
+    ).hexdigest()
 
 
 def set_verification_code(type, verification, code):
-    """Set verify code to redis
+    """Set verify code to redis, only the hash of the code is stored
 
     Args:
         type (str): verify code type [register, update, reset]
@@ -76,4 +172,118 @@ def set_verification_code(type, verification, code):
         code (str): verify code (could be random string or number)
     """
     r = RedisClient()
-    r.set(f"{type}_{verification}", code)
+    key = f"{type}_{verification}"
+    with r.pipeline() as pipe:
+        pipe.hset(key, "code", _hash_code(key, code))
+        pipe.expire(key, settings.VERIFICATION_CODE_EXPIRES)
+        pipe.execute()
+
+
+async def aset_verification_code(type, verification, code):
+    """set_verification_code() for coroutines"""
+    key = f"{type}_{verification}"
+    async with AsyncRedisClient().pipeline() as pipe:
+        pipe.hset(key, "code", _hash_code(key, code))
+        pipe.expire(key, settings.VERIFICATION_CODE_EXPIRES)
+        await pipe.execute()
+
+
+def check_verification_code(type, verification, code):
+    """Compare and consume verify code in one atomic redis call
+
+    Wrong attempts are counted per key, after VERIFICATION_CODE_MAX_ATTEMPTS
+    the code is dropped and the key is locked for VERIFICATION_CODE_LOCKOUT seconds.
+
+    Args:
+        type (str): verify code type [register, update, reset]
+        verification (str): verification
+        code (str): verify code to check
+
+    Returns:
+        int: CODE_OK, CODE_WRONG, CODE_MISSING or CODE_LOCKED
+    """
+    r = RedisClient()
+    key = f"{type}_{verification}"
+    script = r.register_script(CHECK_CODE_SCRIPT)
+    return script(
+        keys=[key, f"{key}_locked"],
+        args=[
+            _hash_code(key, code),
+            settings.VERIFICATION_CODE_MAX_ATTEMPTS,
+            settings.VERIFICATION_CODE_LOCKOUT,
+        ],
+    )
+
+
+async def acheck_verification_code(type, verification, code):
+    """check_verification_code() for coroutines"""
+    key = f"{type}_{verification}"
+    script = AsyncRedisClient().register_script(CHECK_CODE_SCRIPT)
+    return await script(
+        keys=[key, f"{key}_locked"],
+        args=[
+            _hash_code(key, code),
+            settings.VERIFICATION_CODE_MAX_ATTEMPTS,
+            settings.VERIFICATION_CODE_LOCKOUT,
+        ],
+    )
+
+
+def _verification_job(channel, type, verification, code):
+    # the code is worthless once expired, the worker redacts it from the
+    # dead-letter list and its logs
+    return json.dumps(
+        {
+            "channel": channel,
+            "type": type,
+            "verification": verification,
+            "code": code,
+            "expires": time.time() + settings.VERIFICATION_CODE_EXPIRES,
+            "redact": ["code"],
+        }
+    )
+
+
+def dispatch_verification_code(channel, type, verification, code):
+    """Push a verify code onto VERIFICATION_QUEUE,
+    it is sent by `python manage.py worker verification`
+
+    Args:
+        channel (str): delivery channel [sms, email]
+        type (str): verify code type [register, update, reset]
+        verification (str): phone number or email
+        code (str): verify code (could be random string or number)
+    """
+    job = _verification_job(channel, type, verification, code)
+    Queue(settings.VERIFICATION_QUEUE).append(job)
+
+
+async def adispatch_verification_code(channel, type, verification, code):
+    """dispatch_verification_code() for coroutines"""
+    job = _verification_job(channel, type, verification, code)
+    await AsyncQueue(settings.VERIFICATION_QUEUE).append(job)
+
+
+def deliver_verification_code(job):
+    """Queue handler of VERIFICATION_QUEUE, raises DeliveryError to be retried
+
+    Jobs whose code expired while queued or retried are dropped.
+
+    Args:
+        job (dict): job pushed by dispatch_verification_code
+    """
+    if time.time() > job.get("expires", float("inf")):
+        logger.warning(
+            "Verification code to %s expired before delivery", job["verification"]
+        )
+        return
+    if job["channel"] == "sms":
+        ret = send_sms(job["verification"], job["code"], job["type"])
+        if not ret["ok"]:
+            raise DeliveryError(f"{ret['code']}: {ret['message']}")
+    elif job["channel"] == "email":
+        failures = send_email_batch([(job["verification"], job["code"], job["type"])])
+        if failures:
+            raise DeliveryError(f"Email not sent: {failures[0]}")
+    else:
+        raise DeliveryError(f"Unsupported channel {job['channel']}")
@@ -4,10 +4,12 @@ from datetime import timedelta
 import dj_database_url
 import sentry_sdk
 from sentry_sdk.integrations.django import DjangoIntegration
+from sentry_sdk.scope import add_global_event_processor
 
 from utils.cfg import cfg
+from utils.sentry import TraceSampler, parse_rates
 
-from .base import BASE_DIR, INSTALLED_APPS
+from .base import BASE_DIR, INSTALLED_APPS, MIDDLEWARE
 
 # Apps
 INSTALLED_APPS.insert(0, "simpleui")
@@ -40,18 +42,62 @@ DATABASES = {
     "default": dj_database_url.config(
         default=f"{{cookiecutter.database}}://{DATABASE_USER}:{DATABASE_PSWD}@{DATABASE_HOST}:{DATABASE_PORT}/{{cookiecutter.project_name}}",
         conn_max_age=600,
+        conn_health_checks=True,
     )
 }
+# Read replicas, comma separated database urls, see custom.db.router
+DATABASE_REPLICAS = []
+for i, url in enumerate(cfg("database", "replica_urls", default="").split(",")):
+    if url.strip():
+        alias = f"replica{i + 1}"
+        DATABASES[alias] = dj_database_url.parse(
+            url.strip(), conn_max_age=600, conn_health_checks=True
+        )
+        DATABASES[alias]["TEST"] = {"MIRROR": "default"}
+        DATABASE_REPLICAS.append(alias)
+if DATABASE_REPLICAS:
+    DATABASE_ROUTERS = ["custom.db.router.ReplicaRouter"]
+    MIDDLEWARE.append("custom.middleware.ReplicaMiddleware")
+# seconds a client reads from the primary after a write
+REPLICA_STICKY_SECONDS = cfg("database", "replica_sticky", default=10, is_int=True)
+# seconds of replication lag after which a replica is out of rotation
+REPLICA_MAX_LAG = cfg("database", "replica_max_lag", default=5, is_float=True)
+REPLICA_LAG_CHECK_INTERVAL = 5
+
+# Connection pool of custom.db.backends, connections go back to it after every request
+DATABASE_POOL = cfg("database", "pool", default=False, is_bool=True)
+for database in DATABASES.values():
+    if DATABASE_POOL and database["ENGINE"] in (
+        "django.db.backends.postgresql",
+        "django.db.backends.mysql",
+    ):
+        database.update(
+            ENGINE=database["ENGINE"].replace("django.", "custom.", 1),
+            CONN_MAX_AGE=0,
+            POOL={
+                "MIN_SIZE": cfg("database", "pool_min_size", default=2, is_int=True),
+                "MAX_SIZE": cfg("database", "pool_max_size", default=10, is_int=True),
+                "TIMEOUT": cfg("database", "pool_timeout", default=5, is_float=True),
+                "MAX_LIFETIME": 3600,
+                "MAX_IDLE": 600,
+                # ping connections idle longer than this before lending them
+                "CHECK_IDLE": cfg(
+                    "database", "pool_check_idle", default=1, is_float=True
+                ),
+            },
+        )
 
 # Redis
 REDIS_HOST = cfg("redis", "host")
 REDIS_PORT = cfg("redis", "port")
 REDIS_PSWD = cfg("redis", "pswd")
+REDIS_MAX_CONNECTIONS = cfg("redis", "max_connections", default=32, is_int=True)
+REDIS_POOL_TIMEOUT = cfg("redis", "pool_timeout", default=5, is_float=True)
 
 # Rest framework
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "custom.authentication.CachedJWTAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": (
         "rest_framework.permissions.IsAuthenticated",
@@ -63,6 +109,9 @@ REST_FRAMEWORK = {
         "rest_framework.renderers.BrowsableAPIRenderer",
     ),
     "EXCEPTION_HANDLER": "custom.exceptions.custom_exception_handler",
+    # reverse proxies in front of the server, client ips of the throttles
+    # are read from X-Forwarded-For behind them, 0 trusts REMOTE_ADDR only
+    "NUM_PROXIES": cfg("num_proxies", default=1, is_int=True),
 }
 
 # Jwt
@@ -95,26 +144,53 @@ CACHES = {
         "LOCATION": f"redis://{REDIS_PSWD}@{REDIS_HOST}:{REDIS_PORT}/0",
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "CONNECTION_POOL_CLASS": "utils.redis_func.InstrumentedConnectionPool",
+            "CONNECTION_POOL_KWARGS": {
+                "max_connections": REDIS_MAX_CONNECTIONS,
+                "timeout": REDIS_POOL_TIMEOUT,
+            },
+        },
+    },
+    # in-process LRU in front of "default" for hot read-mostly data
+    "tiered": {
+        "BACKEND": "custom.cache.TieredCache",
+        "OPTIONS": {
+            "L2": "default",
+            "L1_TIMEOUT": cfg("cache", "l1_timeout", default=5, is_int=True),
+            "L1_MAX_BYTES": cfg("cache", "l1_max_bytes", default=16777216, is_int=True),
+            "MAX_ENTRIES": 10000,
         },
-    }
+    },
 }
 
 # Sentry
 SENTRY_DSN = cfg("sentry", "dsn")
 if not DEBUG and SENTRY_DSN:
+    # per-route, budgeted and tail-based transaction sampling
+    traces = TraceSampler(
+        rates=parse_rates(
+            cfg(
+                "sentry",
+                "traces_rates",
+                default="POST:/login/=1,POST:/verification/=1,GET:/users/=0.01,/metrics=0",
+            )
+        ),
+        default_rate=cfg("sentry", "traces_sample_rate", default=0.05, is_float=True),
+        record_rate=cfg("sentry", "traces_record_rate", default=0.2, is_float=True),
+        slow=cfg("sentry", "traces_slow", default=1, is_float=True),
+        per_second=cfg("sentry", "traces_per_second", default=1, is_float=True),
+    )
     sentry_sdk.init(
         dsn=SENTRY_DSN,
         integrations=[
             DjangoIntegration(),
         ],
-        # Set traces_sample_rate to 1.0 to capture 100%
-        # of transactions for performance monitoring.
-        # We recommend adjusting this value in production.
-        traces_sample_rate=1.0,
+        traces_sampler=traces.traces_sampler,
         # If you wish to associate users to errors (assuming you are using
         # django.contrib.auth) you may enable sending PII data.
         send_default_pii=True,
     )
+    add_global_event_processor(traces.process_event)
 
 # Logging
 LOG_ROOT = os.path.join(BASE_DIR, "logs")
@@ -10,6 +10,7 @@ AWS_S3_REGION_NAME = cfg("storage", "region")
 AWS_S3_USE_SSL = cfg("storage", "use_ssl", is_bool=True)
 
 # SMS
+SMS_PROVIDER = cfg("sms", "provider", default="utils.sms.TencentSMSProvider")
 SMS_SECRET_ID = cfg("sms", "secret_id")
 SMS_SECRET_KEY = cfg("sms", "secret_key")
 SMS_ENDPOINT = cfg("sms", "endpoint")
@@ -22,7 +23,9 @@ SMS_TEMPLATES = {
 }
 
 # EMAIL
-EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+EMAIL_BACKEND = cfg(
+    "email", "backend", default="django.core.mail.backends.smtp.EmailBackend"
+)
 EMAIL_HOST = cfg("email", "host")
 EMAIL_PORT = cfg("email", "port")
 EMAIL_USE_SSL = cfg("email", "use_ssl", is_bool=True)
@@ -33,6 +36,62 @@ EMAIL_FROM = f"{cfg('email', 'from')} <{EMAIL_HOST_USER}>"
 # verification code
 VERIFICATION_CODE_EXPIRES = 600
 VERIFICATION_CODE_INTERVAL = 120
+VERIFICATION_CODE_MAX_ATTEMPTS = 5
+VERIFICATION_CODE_LOCKOUT = 1800
+
+# Server started by start.sh, uwsgi (WSGI) or uvicorn (ASGI, async login and verification views)
+SERVER = cfg("server", default="uwsgi")
+
+# Throttle, (requests, seconds) windows per ident, see custom.throttling
+THROTTLE_RATES = {
+    "verification": {
+        "phone": [(1, VERIFICATION_CODE_INTERVAL), (10, 86400)],
+        "ip": [(5, 60), (30, 86400)],
+        "global": [
+            (cfg("throttle", "verification_global", default=60, is_int=True), 60)
+        ],
+    },
+    "login": {
+        "phone": [(10, 60), (30, 3600)],
+        "ip": [(20, 60), (200, 3600)],
+    },
+}
+
+# Pagination, total count of custom.pagination.KeysetPagination
+PAGINATION_COUNT = cfg("pagination", "count", default="cached")  # none, approximate
+PAGINATION_COUNT_TIMEOUT = 60  # seconds a cached count is fresh
+
+# Response cache of custom.mixins.CachedResponseMixin, 0 disables it
+RESPONSE_CACHE_TIMEOUT = cfg("cache", "response_timeout", default=300, is_int=True)
+
+# Users resolved by custom.authentication.CachedJWTAuthentication
+AUTH_USER_CACHE = "tiered"
+AUTH_USER_CACHE_TIMEOUT = cfg("auth", "user_cache_timeout", default=60, is_int=True)
+
+# Queue workers, `python manage.py worker <queue>`
+VERIFICATION_QUEUE = "verification"
+IMPORT_EXPORT_QUEUE = "import_export"
+IMPORT_BACKGROUND_SIZE = 1048576  # bytes, larger admin uploads are imported by a worker
+QUEUE_HANDLERS = {
+    VERIFICATION_QUEUE: "utils.verify.deliver_verification_code",
+    IMPORT_EXPORT_QUEUE: "core.resources.run_job",
+}
+QUEUE_MAX_RETRIES = 5
+QUEUE_RETRY_BACKOFF = 2  # seconds, doubled on every retry
+QUEUE_VISIBILITY_TIMEOUT = 60  # seconds, jobs of a dead worker are requeued after it
+QUEUE_PROMOTE_INTERVAL = 1  # seconds between promotions of due delayed jobs
+# callables run by one of the workers every interval seconds
+QUEUE_PERIODIC_TASKS = {
+    "core.last_login.flush_last_login": cfg(
+        "last_login", "flush_interval", default=10, is_int=True
+    ),
+}
+
+# Request metrics of custom.middleware.MetricsMiddleware, served at /metrics
+METRICS_TOKEN = cfg("metrics", "token")  # bearer token of /metrics, unset disables it
+METRICS_FLUSH_INTERVAL = 10  # seconds between flushes of a worker's metrics to redis
+# Server-Timing header with db/redis timings, it is sent to every client
+METRICS_SERVER_TIMING = cfg("metrics", "server_timing", default=False, is_bool=True)
 
 # Admin
 ADMIN_SITE_TITLE = cfg("admin", "site_title")
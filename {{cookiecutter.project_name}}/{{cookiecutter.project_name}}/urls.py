@@ -19,6 +19,8 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from custom.views import prometheus_metrics
+
 schema_view = get_schema_view(
     openapi.Info(
         title="{{cookiecutter.project_name}} API",
@@ -44,5 +46,6 @@ urlpatterns = [
         r"^redoc/$", schema_view.with_ui("redoc", cache_timeout=0), name="schema-redoc"
     ),
     path("admin/", admin.site.urls),
+    path("metrics", prometheus_metrics),
     path(r"", include(("core.urls", "core"), namespace="core")),
 ]